@@ -0,0 +1,82 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Measures what importing the bot costs, with python's -X importtime,
+every run is a fresh interpreter so nothing is cached but the bytecode
+
+Usage (from the Ayumi folder): python -m benchmarks.importtime [runs] [modules...]
+"""
+import sys
+import statistics
+import subprocess
+import collections
+from typing import List, NamedTuple
+
+DEFAULT_MODULES = ["core", "utils", "extensions.anilist", "extensions.reminders"]
+TOP_PACKAGES = 15
+
+
+class ImportTime(NamedTuple):
+    name: str
+    self_time: int  # microseconds
+    cumulative: int
+
+
+def measure(modules: List[str]) -> List[ImportTime]:
+    """Imports the modules in a fresh interpreter, returns what it reported"""
+    code = "; ".join(f"import {module}" for module in modules)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue  # the header, or a warning
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        times.append(ImportTime(name.strip(), int(self_time), int(cumulative)))
+    return times
+
+
+def main(runs: int = 5, *modules: str):
+    modules = list(modules) or DEFAULT_MODULES
+    totals = collections.defaultdict(list)
+    packages = collections.defaultdict(list)
+
+    for _ in range(runs):
+        times = measure(modules)
+        cumulative = {time.name: time.cumulative for time in times}
+        for module in modules:
+            totals[module].append(cumulative.get(module, 0))
+
+        spent = collections.Counter()
+        for time in times:
+            spent[time.name.split(".")[0]] += time.self_time
+        for package, package_time in spent.items():
+            packages[package].append(package_time)
+
+    print(f"median of {runs} runs, in ms\n")
+    print(f"{'module':<30} {'cumulative':>10}")
+    for module in modules:
+        print(f"{module:<30} {statistics.median(totals[module]) / 1000:>10.1f}")
+
+    print(f"\n{'top level package':<30} {'self':>10}")
+    slowest = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, package_times in slowest[:TOP_PACKAGES]:
+        print(f"{package:<30} {statistics.median(package_times) / 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5, *sys.argv[2:])
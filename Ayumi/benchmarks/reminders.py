@@ -0,0 +1,99 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Measures how many reminders per second the delivery stage goes through,
+discord and postgres are replaced by no-op objects so only our own work is timed
+
+Usage (from the Ayumi folder): python -m benchmarks.reminders [reminders] [channels]
+"""
+import sys
+import time
+import random
+import asyncio
+import datetime as dt
+
+from extensions import reminders
+
+ANIME_NAMES = [f"Anime {i}" for i in range(20)]
+
+
+class FakeChannel:
+    async def send(self, content: str, **kwargs):
+        pass
+
+
+class FakePool:
+    async def execute(self, query: str, *args):
+        pass
+
+    async def buffer(self, method: str, query: str, *args, callback=None, key=None):
+        pass
+
+
+class FakeBot:
+    def __init__(self):
+        self.pool = FakePool()
+        self.channel = FakeChannel()
+
+    def get_channel(self, channel_id: int) -> FakeChannel:
+        return self.channel
+
+    def dispatch(self, *args, **kwargs):
+        pass
+
+
+def make_reminders(amount: int, channels: int):
+    """Everyone waits for the same airing time, the worst case"""
+    trigger_time = dt.datetime.now(dt.timezone.utc)
+    return [
+        reminders.Reminder(
+            trigger_time,
+            i,
+            random.randrange(10 ** 17, 10 ** 18),
+            random.choice(ANIME_NAMES),
+            random.randrange(channels),
+        )
+        for i in range(amount)
+    ]
+
+
+def main(amount: int = 100_000, channels: int = 500):
+    batch = make_reminders(amount, channels)
+    cog = reminders.Reminders.__new__(reminders.Reminders)
+    cog.bot = FakeBot()
+    cog.delivered = cog.messages_sent = 0
+
+    start = time.perf_counter()
+    grouped = reminders.group_reminders(batch)
+    messages = [
+        content
+        for medias in grouped.values()
+        for name, user_ids in medias.items()
+        for content in reminders.format_reminder_messages(name, user_ids)
+    ]
+    grouping_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.get_event_loop().run_until_complete(cog.deliver(batch))
+    delivery_time = time.perf_counter() - start
+
+    print(f"{amount} reminders in {channels} channels -> {len(messages)} messages")
+    print(f"grouping + formatting: {grouping_time * 1000:.1f}ms "
+          f"({amount / grouping_time:,.0f} reminders/s)")
+    print(f"full delivery: {delivery_time * 1000:.1f}ms "
+          f"({amount / delivery_time:,.0f} reminders/s)")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
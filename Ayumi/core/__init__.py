@@ -19,3 +19,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from .bot import Bot
 from .context import Context
 from .logger import WebhookHandler
+from .anilist import AnilistClient, AnilistError, Priority, Media
+from .sessions import MenuRegistry, RegisteredMenu
+from .spool import Spool
+from .storage import Storage, StorageUnavailable
@@ -0,0 +1,417 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import enum
+import json
+import time
+import asyncio
+import operator
+import itertools
+import datetime as dt
+from typing import Dict, Optional, List
+
+import aiohttp
+from discord.ext import commands
+
+import utils
+
+from . import countries
+
+ANILIST_URL = "https://graphql.anilist.co"
+
+# https://anilist.gitbook.io/anilist-apiv2-docs/overview/rate-limiting
+RATE_LIMIT = 90
+RATE_LIMIT_PER = 60
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+DEFAULT_RETRY_AFTER = 60
+
+
+class Priority(enum.IntEnum):
+    """Lower goes first"""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class AnilistError(commands.CommandError):
+    """Base class for anilist related errors"""
+
+
+class AnilistHTTPError(AnilistError):
+    def __init__(self, status: int, errors: List[str]):
+        self.status = status
+        self.errors = errors
+
+    def __str__(self):
+        return '\n'.join(self.errors) or f"Anilist answered with status {self.status}"
+
+
+class AnilistUnavailable(AnilistError):
+    def __str__(self):
+        return "Sorry ! Anilist isn't reachable at the moment, try again later"
+
+
+class _Job:
+    """A request waiting for its turn"""
+    __slots__ = ('json', 'future', 'attempts')
+
+    def __init__(self, json_: dict, future: asyncio.Future):
+        self.json = json_
+        self.future = future
+        self.attempts = 0
+
+
+class AnilistClient:
+    """
+    Sends queries to anilist while staying under their rate limit,
+    interactive requests are always dispatched before background ones
+    """
+    def __init__(self,
+                 session: aiohttp.ClientSession, *,
+                 cache: Optional["utils.TieredCache"] = None,
+                 url: str = ANILIST_URL):
+        self.session = session
+        self.url = url
+        self.cache = cache
+        self.in_flight = utils.SingleFlight()
+        self.bucket = utils.TokenBucket(RATE_LIMIT, RATE_LIMIT_PER)
+        self.paused_until = 0.0
+        self.requests_sent = 0
+        self.rate_limited = 0
+        self._queue = asyncio.PriorityQueue()
+        self._counter = itertools.count()
+        self._dispatcher = None
+        self._sending: Dict[asyncio.Task, _Job] = {}
+        self._retrying: Dict[_Job, asyncio.TimerHandle] = {}
+
+    # Public api
+
+    async def request(self,
+                      query: str,
+                      variables: dict, *,
+                      ttl: Optional[float] = None,
+                      priority: Priority = Priority.INTERACTIVE,
+                      use_cache: bool = True) -> dict:
+        """
+        Posts a query to anilist, successful responses are cached for ttl seconds,
+        bulk jobs skip the cache so they don't evict what people are looking at
+        """
+        key = utils.make_cache_key(query, variables)
+        use_cache = use_cache and self.cache is not None
+
+        if use_cache and (cached := await self.cache.get(key)) is not None:
+            return cached
+
+        return await self.in_flight.do(key, self._fetch, key, query, variables, ttl, priority, use_cache)
+
+    def close(self):
+        """Stops dispatching, pending requests are cancelled, including the ones being sent or retried"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+        while not self._queue.empty():
+            *_, job = self._queue.get_nowait()
+            job.future.cancel()
+
+        for task, job in self._sending.items():
+            task.cancel()
+            job.future.cancel()
+        self._sending.clear()
+
+        for job, handle in self._retrying.items():
+            handle.cancel()
+            job.future.cancel()
+        self._retrying.clear()
+
+    # Internals
+
+    async def _fetch(self, key: str, query: str, variables: dict, ttl: Optional[float],
+                     priority: Priority, use_cache: bool) -> dict:
+        """The actual request, shared by every identical query made meanwhile"""
+        loop = asyncio.get_event_loop()
+        job = _Job({'query': query, 'variables': variables}, loop.create_future())
+        self._put(priority, job)
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        resp, raw = await job.future
+
+        if use_cache:
+            await self.cache.set(key, resp, size=len(raw), ttl=ttl, payload=raw)
+
+        return resp
+
+    def _put(self, priority: Priority, job: _Job):
+        self._queue.put_nowait((priority, next(self._counter), job))
+
+    async def _wait_for_capacity(self):
+        """Waits for both a global pause (429) to end and a token to be available"""
+        while True:
+            if (pause := self.paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            if delay := self.bucket.consume():
+                await asyncio.sleep(delay)
+                continue
+
+            return
+
+    async def _dispatch(self):
+        """Pops jobs by priority, one token each"""
+        while True:
+            priority, _, job = await self._queue.get()
+
+            if job.future.done():  # everyone waiting for it is gone
+                continue
+
+            await self._wait_for_capacity()
+            task = asyncio.ensure_future(self._send(priority, job))
+            self._sending[task] = job
+            task.add_done_callback(lambda task: self._sending.pop(task, None))
+
+    def _read_rate_limit_headers(self, headers) -> Optional[float]:
+        """Updates the bucket, returns for how long we should pause if we must"""
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        self.bucket.update(
+            limit=int(limit) if limit and limit.isdigit() else None,
+            remaining=int(remaining) if remaining and remaining.isdigit() else None,
+        )
+
+        if retry_after := headers.get('Retry-After'):
+            try:
+                return float(retry_after)
+            except ValueError:
+                return DEFAULT_RETRY_AFTER
+
+        if remaining == '0' and (reset := headers.get('X-RateLimit-Reset')):
+            try:
+                return max(float(reset) - time.time(), 0)
+            except ValueError:
+                return DEFAULT_RETRY_AFTER
+
+        return None
+
+    @staticmethod
+    def _parse_errors(status: int, reason: str, resp: Optional[dict]) -> List[str]:
+        """Anilist errors look like {"errors": [{"status": ..., "message": ...}]}, but not always"""
+        if isinstance(resp, dict) and isinstance(errors := resp.get('errors'), list):
+            return [f"{err.get('status', status)}: {err.get('message')}" for err in errors]
+        return [f"{status}: {reason}"]
+
+    def _retry(self, priority: Priority, job: _Job, delay: float):
+        """Puts a job back in the queue after some delay"""
+        loop = asyncio.get_event_loop()
+        self._retrying[job] = loop.call_later(delay, self._requeue, priority, job)
+
+    def _requeue(self, priority: Priority, job: _Job):
+        del self._retrying[job]
+        self._put(priority, job)
+
+    async def _send(self, priority: Priority, job: _Job):
+        """Whatever goes wrong, the job's future gets resolved, everyone sharing it would hang otherwise"""
+        try:
+            await self._attempt(priority, job)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+    async def _attempt(self, priority: Priority, job: _Job):
+        job.attempts += 1
+        self.requests_sent += 1
+
+        try:
+            async with self.session.post(self.url, json=job.json) as r:
+                raw = await r.read()
+                status, reason, headers = r.status, r.reason, r.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if job.attempts < MAX_ATTEMPTS:
+                return self._retry(priority, job, BACKOFF_BASE * 2 ** job.attempts)
+            if not job.future.done():
+                job.future.set_exception(AnilistUnavailable())
+            return
+
+        if pause := self._read_rate_limit_headers(headers):
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+        try:
+            resp = json.loads(raw)
+        except ValueError:  # html error pages
+            resp = None
+
+        if job.future.done():
+            return
+
+        if status == 200 and resp is not None:
+            return job.future.set_result((resp, raw))
+
+        if status == 429 or status >= 500:
+            if status == 429:
+                self.rate_limited += 1
+
+            if job.attempts < MAX_ATTEMPTS:
+                return self._retry(priority, job, pause or BACKOFF_BASE * 2 ** job.attempts)
+
+            if status >= 500:
+                return job.future.set_exception(AnilistUnavailable())
+
+        errors = self._parse_errors(status, reason, resp)
+        job.future.set_exception(AnilistHTTPError(status, errors))
+
+
+# Model
+
+DATE_GETTER = operator.itemgetter("year", "month", "day")
+
+
+def format_fuzzy_date(date: Optional[dict]) -> str:
+    """Anilist dates might only be partially known"""
+    date_info = DATE_GETTER(date) if date else (None, None, None)
+
+    if all(date_info):
+        return dt.datetime(*date_info).strftime("%A, %d %B %Y")
+
+    if any(date_info):
+        return '/'.join(f"{d:02}" if d else '00' for d in reversed(date_info))
+
+    return '?'
+
+
+def get_country_name(alpha_2: str) -> str:
+    """Prefers the official name, falls back to the code itself if it's unknown"""
+    return countries.COUNTRY_NAMES.get(alpha_2, alpha_2)
+
+
+class Media:
+    """
+    A media, parsed once when it arrives so that the raw dict can be dropped,
+    attributes are None if the field wasn't fetched (yet) or anilist has nothing
+    """
+    __slots__ = (
+        'id', 'is_adult', 'format', 'season_year', 'titles', 'main_title',
+        'cover_medium', 'cover_large', 'color', 'banner', 'next_airing_at',
+        'description', 'start_date', 'end_date', 'season', 'country', 'status', 'source',
+        'episodes', 'duration', 'chapters', 'volumes',
+        'average_score', 'popularity', 'favourites', 'hashtag',
+        'id_mal', 'type', 'site_url', 'trailer', 'first_episode', 'latest_episode',
+        'characters', 'synonyms',
+    )
+
+    def __init__(self, data: dict):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.update(data)
+
+    def __repr__(self) -> str:
+        return f"<Media id={self.id} title={self.main_title!r}>"
+
+    def update(self, data: dict):
+        """Parses the fields present in data, so that lazy fields can be added later"""
+        get = data.get
+
+        # Base
+
+        self.id = get("id", self.id)
+
+        if "isAdult" in data:
+            self.is_adult = data["isAdult"]
+
+        if "format" in data:
+            self.format = data["format"]
+
+        if "seasonYear" in data:
+            self.season_year = data["seasonYear"]
+
+        if title := get("title"):
+            self.titles = operator.itemgetter("english", "romaji", "native")(title)
+            self.main_title = next(filter(None, self.titles), None)
+
+        if cover := get("coverImage"):
+            self.cover_medium = cover.get("medium")
+            self.cover_large = cover.get("extraLarge")
+            if color_hex := cover.get("color"):
+                self.color = int(color_hex[1:], 16)
+
+        if "bannerImage" in data:
+            self.banner = data["bannerImage"]
+
+        if "nextAiringEpisode" in data:
+            next_airing_ep = data["nextAiringEpisode"]
+            self.next_airing_at = next_airing_ep and dt.datetime.fromtimestamp(
+                next_airing_ep["airingAt"],
+                tz=dt.timezone.utc
+            )
+
+        if "description" in data:
+            self.description = utils.remove_html_tags(data["description"] or '') or None
+
+        # Calendar
+
+        if "startDate" in data:
+            self.start_date = format_fuzzy_date(data["startDate"])
+
+        if "endDate" in data:
+            self.end_date = format_fuzzy_date(data["endDate"])
+
+        if country_of_origin := get("countryOfOrigin"):
+            self.country = get_country_name(country_of_origin)
+
+        for name, key in (("season", "season"), ("status", "status"), ("source", "source")):
+            if value := get(key):
+                setattr(self, name, value.replace('_', ' ').lower().title())
+
+        # Stopwatch / community
+
+        for name, key in (
+            ("episodes", "episodes"),
+            ("duration", "duration"),
+            ("chapters", "chapters"),
+            ("volumes", "volumes"),
+            ("average_score", "averageScore"),
+            ("popularity", "popularity"),
+            ("favourites", "favourites"),
+            ("hashtag", "hashtag"),
+            ("id_mal", "idMal"),
+            ("type", "type"),
+            ("site_url", "siteUrl"),
+        ):
+            if key in data:
+                setattr(self, name, data[key])
+
+        # Links and characters, only what's shown is kept
+
+        if trailer := get("trailer"):
+            self.trailer = (trailer["site"], trailer["id"])
+
+        if streaming_episodes := get("streamingEpisodes"):
+            latest, first = streaming_episodes[0], streaming_episodes[-1]
+            self.first_episode = (first["site"], first["url"])
+            self.latest_episode = (latest["site"], latest["url"])
+
+        if characters := get("characters"):
+            self.characters = tuple(
+                (node["name"]["full"] or node["name"]["native"], node["siteUrl"])
+                for node in characters["nodes"]
+            )
+
+        if "synonyms" in data:
+            self.synonyms = tuple(data["synonyms"] or ())
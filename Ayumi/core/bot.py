@@ -16,10 +16,12 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import time
 import pathlib
 import logging
 import traceback
 import inspect
+import functools
 from typing import Union, Tuple, Callable, Optional
 
 import discord
@@ -27,6 +29,7 @@ from discord.ext import commands, tasks
 
 import aiohttp
 import asyncpg
+import aioredis
 
 import core
 import config
@@ -34,22 +37,48 @@ import utils
 
 from . import context
 from . import fallback
+from . import sessions
+from . import spool
+from . import storage
+from . import loader
 
 LOGGING_LEVEL = logging.INFO
 EVENT_ERROR_TEMPLATE = "Exception occured in event %s :\n%s"
 COMMAND_ERROR_TEMPLATE = "Exception occured in command \"%s\"\n\nCalled with: \"%s\"\n\n%s"
+MAX_TYPO_DISTANCE = 2
+LOG_SPOOL_DIRECTORY = pathlib.Path('./spool/logs')
+
+# Overridden by config.PSQL_POOL_OPTIONS, passed as is to asyncpg.create_pool
+DEFAULT_POOL_OPTIONS = {
+    "min_size": 2,
+    "max_size": 10,
+    "statement_cache_size": 256,  # our hot queries stay prepared on every connection
+    "max_inactive_connection_lifetime": 300,
+    "command_timeout": 10,  # a hanging query counts as a failure for the circuit breaker
+}
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.load_extension('jishaku')
+
+        for extension, (name, *aliases) in loader.LAZY_EXTENSIONS.items():
+            loader.add_lazy_extension(self, extension, name, *aliases)
+
         self._session = None
         self._webhook = None
         self._logger = None
         self._pool = None
+        self._redis = None
+        self._menus = sessions.MenuRegistry(self)
+        self._command_index = None
 
     async def connect(self, *args, **kwargs):
         """Used as an async alternative init"""
+        start = time.perf_counter()
+
+        # Extensions get imported while we connect to everything
+        imports = loader.preimport(loader.find_extensions(), self.loop)
+
         self._session = session = aiohttp.ClientSession()
 
         self._logger = logger = logging.getLogger('discord')
@@ -57,29 +86,42 @@ class Bot(commands.Bot):
         adapter = discord.AsyncWebhookAdapter(session)
         self._webhook = discord.Webhook.from_url(config.LOGGER_URL, adapter=adapter)
         logger.setLevel(LOGGING_LEVEL)
-        handler = core.WebhookHandler(self, level=LOGGING_LEVEL)
+        try:
+            log_spool = spool.Spool(LOG_SPOOL_DIRECTORY)
+        except OSError:
+            traceback.print_exc()
+            log_spool = None
+
+        # Logger name: fraction of its records that gets sent, errors are always sent
+        sampling = getattr(config, 'LOG_SAMPLING', {})
+        handler = core.WebhookHandler(self, level=LOGGING_LEVEL, sampling=sampling, spool=log_spool)
         logger.addHandler(handler)
 
         logger.info('Started connecting to storage')
 
+        pool_options = {**DEFAULT_POOL_OPTIONS, **getattr(config, 'PSQL_POOL_OPTIONS', {})}
+        create_pool = functools.partial(asyncpg.create_pool,
+                                        config.PSQL_URL,
+                                        password=config.PSQL_PASSWORD,
+                                        **pool_options)
+        self._pool = storage.Storage(create_pool, name='psql', logger=logger)
+        await self._pool.start()
+
         try:
-            self._pool = await asyncpg.create_pool(config.PSQL_URL,
-                                                   password=config.PSQL_PASSWORD)
+            self._redis = await aioredis.create_redis_pool(config.REDIS_URL)
         except Exception as e:
-            self.dispatch("error", "PSQL connection", exception=e, level='critical')
-            self._pool = fallback.Fallback('psql', logger)
+            self.dispatch("error", "Redis connection", exception=e, level='critical')
+            self._redis = fallback.Fallback('redis', logger)
         else:
-            logger.info('Connected to psql')
+            logger.info('Connected to redis')
 
-        for file in pathlib.Path('./extensions').glob('**/*.py'):
-            ext_path = '.'.join(file.parts[:-1]) + '.' + file.stem
-            try:
-                self.load_extension(ext_path)
-            except Exception as e:
-                print(e)
-            else:
-                logger.info('Loaded %s', ext_path)
+        timings = await loader.load_extensions(self, imports)
+        for timing in timings:
+            if timing.error is not None:
+                self.dispatch("error", f"Loading {timing.name}", exception=timing.error)
 
+        table = loader.format_timings(timings, time.perf_counter() - start)
+        logger.info("Loaded extensions\n```\n%s```", table)
 
         logger.info('Finishing initializing')
 
@@ -90,9 +132,17 @@ class Bot(commands.Bot):
         return self._logger
 
     @property
-    def pool(self) -> asyncpg.Connection:
+    def pool(self) -> storage.Storage:
         return self._pool
 
+    @property
+    def redis(self) -> aioredis.Redis:
+        return self._redis
+
+    @property
+    def menus(self) -> sessions.MenuRegistry:
+        return self._menus
+
     @property
     def session(self) -> aiohttp.ClientSession:
         return self._session
@@ -105,6 +155,14 @@ class Bot(commands.Bot):
     async def get_context(self, msg: discord.Message, cls=context.Context) -> context.Context:
         return await super().get_context(msg, cls=cls)
 
+    # Menus, reactions are routed by message id
+
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        self.menus.dispatch(payload)
+
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        self.menus.dispatch(payload)
+
     # Error handling
 
     async def on_error(self, event: str, *args, **kwargs):
@@ -119,15 +177,29 @@ class Bot(commands.Bot):
         log_method = kwargs.get('level', log_method)
         log_method(EVENT_ERROR_TEMPLATE, event, clean_tb)
     
+    # Typo correction
+
+    def add_command(self, command: commands.Command):
+        super().add_command(command)
+        self._command_index = None  # rebuilt on the next typo
+
+    def remove_command(self, name: str) -> Optional[commands.Command]:
+        self._command_index = None
+        return super().remove_command(name)
+
+    @property
+    def command_index(self) -> "utils.BKTree":
+        """Every command's qualified name, built once per set of loaded commands"""
+        if self._command_index is None:
+            self._command_index = utils.BKTree(sorted(map(str, self.walk_commands())))
+        return self._command_index
+
     def fuzzy_search_commands(self, user_input: str) -> Optional[commands.Command]:
-        command_gen = self.walk_commands()
-        commands_names = [*map(str, command_gen)]
-        try:
-            command_name = utils.Literal[commands_names](user_input)
-        except commands.BadArgument:
-            return None
-        else:
+        user_input = user_input.casefold()
+        max_distance = max(1, min(MAX_TYPO_DISTANCE, len(user_input) // 3))
+        if command_name := self.command_index.closest(user_input, max_distance):
             return self.get_command(command_name)
+        return None
 
     async def on_command_error(self, ctx: context.Context, error: Exception):
         """Logs errors for command, then send them into the user"""
@@ -163,12 +235,22 @@ class Bot(commands.Bot):
     async def close(self):
         """Close all of our external connections"""
         try:
+            self.logger.info("Pool usage\n```\n%s```", self.pool.report())
             await self.pool.close()
         except Exception:
             traceback.print_exc()
         else:
             self.logger.info('Pool is closed')
 
+        if self.redis:  # nothing to close if it's a fallback
+            try:
+                self.redis.close()
+                await self.redis.wait_closed()
+            except Exception:
+                traceback.print_exc()
+            else:
+                self.logger.info('Redis is closed')
+
         try:
             await self.session.close()
         except Exception:
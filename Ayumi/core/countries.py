@@ -0,0 +1,274 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Generated by scripts/generate_countries.py from pycountry 26.2.16, don't edit it by hand
+"""
+
+import types
+
+# ISO 3166-1 alpha-2 code -> official name, or the usual one if there's no official name
+COUNTRY_NAMES = types.MappingProxyType({
+    'AD': 'Principality of Andorra',
+    'AE': 'United Arab Emirates',
+    'AF': 'Islamic Republic of Afghanistan',
+    'AG': 'Antigua and Barbuda',
+    'AI': 'Anguilla',
+    'AL': 'Republic of Albania',
+    'AM': 'Republic of Armenia',
+    'AO': 'Republic of Angola',
+    'AQ': 'Antarctica',
+    'AR': 'Argentine Republic',
+    'AS': 'American Samoa',
+    'AT': 'Republic of Austria',
+    'AU': 'Australia',
+    'AW': 'Aruba',
+    'AX': 'Åland Islands',
+    'AZ': 'Republic of Azerbaijan',
+    'BA': 'Republic of Bosnia and Herzegovina',
+    'BB': 'Barbados',
+    'BD': "People's Republic of Bangladesh",
+    'BE': 'Kingdom of Belgium',
+    'BF': 'Burkina Faso',
+    'BG': 'Republic of Bulgaria',
+    'BH': 'Kingdom of Bahrain',
+    'BI': 'Republic of Burundi',
+    'BJ': 'Republic of Benin',
+    'BL': 'Saint Barthélemy',
+    'BM': 'Bermuda',
+    'BN': 'Brunei Darussalam',
+    'BO': 'Plurinational State of Bolivia',
+    'BQ': 'Bonaire, Sint Eustatius and Saba',
+    'BR': 'Federative Republic of Brazil',
+    'BS': 'Commonwealth of the Bahamas',
+    'BT': 'Kingdom of Bhutan',
+    'BV': 'Bouvet Island',
+    'BW': 'Republic of Botswana',
+    'BY': 'Republic of Belarus',
+    'BZ': 'Belize',
+    'CA': 'Canada',
+    'CC': 'Cocos (Keeling) Islands',
+    'CD': 'Congo, The Democratic Republic of the',
+    'CF': 'Central African Republic',
+    'CG': 'Republic of the Congo',
+    'CH': 'Swiss Confederation',
+    'CI': "Republic of Côte d'Ivoire",
+    'CK': 'Cook Islands',
+    'CL': 'Republic of Chile',
+    'CM': 'Republic of Cameroon',
+    'CN': "People's Republic of China",
+    'CO': 'Republic of Colombia',
+    'CR': 'Republic of Costa Rica',
+    'CU': 'Republic of Cuba',
+    'CV': 'Republic of Cabo Verde',
+    'CW': 'Curaçao',
+    'CX': 'Christmas Island',
+    'CY': 'Republic of Cyprus',
+    'CZ': 'Czech Republic',
+    'DE': 'Federal Republic of Germany',
+    'DJ': 'Republic of Djibouti',
+    'DK': 'Kingdom of Denmark',
+    'DM': 'Commonwealth of Dominica',
+    'DO': 'Dominican Republic',
+    'DZ': "People's Democratic Republic of Algeria",
+    'EC': 'Republic of Ecuador',
+    'EE': 'Republic of Estonia',
+    'EG': 'Arab Republic of Egypt',
+    'EH': 'Western Sahara',
+    'ER': 'the State of Eritrea',
+    'ES': 'Kingdom of Spain',
+    'ET': 'Federal Democratic Republic of Ethiopia',
+    'FI': 'Republic of Finland',
+    'FJ': 'Republic of Fiji',
+    'FK': 'Falkland Islands (Malvinas)',
+    'FM': 'Federated States of Micronesia',
+    'FO': 'Faroe Islands',
+    'FR': 'French Republic',
+    'GA': 'Gabonese Republic',
+    'GB': 'United Kingdom of Great Britain and Northern Ireland',
+    'GD': 'Grenada',
+    'GE': 'Georgia',
+    'GF': 'French Guiana',
+    'GG': 'Guernsey',
+    'GH': 'Republic of Ghana',
+    'GI': 'Gibraltar',
+    'GL': 'Greenland',
+    'GM': 'Republic of the Gambia',
+    'GN': 'Republic of Guinea',
+    'GP': 'Guadeloupe',
+    'GQ': 'Republic of Equatorial Guinea',
+    'GR': 'Hellenic Republic',
+    'GS': 'South Georgia and the South Sandwich Islands',
+    'GT': 'Republic of Guatemala',
+    'GU': 'Guam',
+    'GW': 'Republic of Guinea-Bissau',
+    'GY': 'Republic of Guyana',
+    'HK': 'Hong Kong Special Administrative Region of China',
+    'HM': 'Heard Island and McDonald Islands',
+    'HN': 'Republic of Honduras',
+    'HR': 'Republic of Croatia',
+    'HT': 'Republic of Haiti',
+    'HU': 'Hungary',
+    'ID': 'Republic of Indonesia',
+    'IE': 'Ireland',
+    'IL': 'State of Israel',
+    'IM': 'Isle of Man',
+    'IN': 'Republic of India',
+    'IO': 'British Indian Ocean Territory',
+    'IQ': 'Republic of Iraq',
+    'IR': 'Islamic Republic of Iran',
+    'IS': 'Republic of Iceland',
+    'IT': 'Italian Republic',
+    'JE': 'Jersey',
+    'JM': 'Jamaica',
+    'JO': 'Hashemite Kingdom of Jordan',
+    'JP': 'Japan',
+    'KE': 'Republic of Kenya',
+    'KG': 'Kyrgyz Republic',
+    'KH': 'Kingdom of Cambodia',
+    'KI': 'Republic of Kiribati',
+    'KM': 'Union of the Comoros',
+    'KN': 'Saint Kitts and Nevis',
+    'KP': "Democratic People's Republic of Korea",
+    'KR': 'Korea, Republic of',
+    'KW': 'State of Kuwait',
+    'KY': 'Cayman Islands',
+    'KZ': 'Republic of Kazakhstan',
+    'LA': "Lao People's Democratic Republic",
+    'LB': 'Lebanese Republic',
+    'LC': 'Saint Lucia',
+    'LI': 'Principality of Liechtenstein',
+    'LK': 'Democratic Socialist Republic of Sri Lanka',
+    'LR': 'Republic of Liberia',
+    'LS': 'Kingdom of Lesotho',
+    'LT': 'Republic of Lithuania',
+    'LU': 'Grand Duchy of Luxembourg',
+    'LV': 'Republic of Latvia',
+    'LY': 'Libya',
+    'MA': 'Kingdom of Morocco',
+    'MC': 'Principality of Monaco',
+    'MD': 'Republic of Moldova',
+    'ME': 'Montenegro',
+    'MF': 'Saint Martin (French part)',
+    'MG': 'Republic of Madagascar',
+    'MH': 'Republic of the Marshall Islands',
+    'MK': 'Republic of North Macedonia',
+    'ML': 'Republic of Mali',
+    'MM': 'Republic of Myanmar',
+    'MN': 'Mongolia',
+    'MO': 'Macao Special Administrative Region of China',
+    'MP': 'Commonwealth of the Northern Mariana Islands',
+    'MQ': 'Martinique',
+    'MR': 'Islamic Republic of Mauritania',
+    'MS': 'Montserrat',
+    'MT': 'Republic of Malta',
+    'MU': 'Republic of Mauritius',
+    'MV': 'Republic of Maldives',
+    'MW': 'Republic of Malawi',
+    'MX': 'United Mexican States',
+    'MY': 'Malaysia',
+    'MZ': 'Republic of Mozambique',
+    'NA': 'Republic of Namibia',
+    'NC': 'New Caledonia',
+    'NE': 'Republic of the Niger',
+    'NF': 'Norfolk Island',
+    'NG': 'Federal Republic of Nigeria',
+    'NI': 'Republic of Nicaragua',
+    'NL': 'Kingdom of the Netherlands',
+    'NO': 'Kingdom of Norway',
+    'NP': 'Federal Democratic Republic of Nepal',
+    'NR': 'Republic of Nauru',
+    'NU': 'Niue',
+    'NZ': 'New Zealand',
+    'OM': 'Sultanate of Oman',
+    'PA': 'Republic of Panama',
+    'PE': 'Republic of Peru',
+    'PF': 'French Polynesia',
+    'PG': 'Independent State of Papua New Guinea',
+    'PH': 'Republic of the Philippines',
+    'PK': 'Islamic Republic of Pakistan',
+    'PL': 'Republic of Poland',
+    'PM': 'Saint Pierre and Miquelon',
+    'PN': 'Pitcairn',
+    'PR': 'Puerto Rico',
+    'PS': 'the State of Palestine',
+    'PT': 'Portuguese Republic',
+    'PW': 'Republic of Palau',
+    'PY': 'Republic of Paraguay',
+    'QA': 'State of Qatar',
+    'RE': 'Réunion',
+    'RO': 'Romania',
+    'RS': 'Republic of Serbia',
+    'RU': 'Russian Federation',
+    'RW': 'Rwandese Republic',
+    'SA': 'Kingdom of Saudi Arabia',
+    'SB': 'Solomon Islands',
+    'SC': 'Republic of Seychelles',
+    'SD': 'Republic of the Sudan',
+    'SE': 'Kingdom of Sweden',
+    'SG': 'Republic of Singapore',
+    'SH': 'Saint Helena, Ascension and Tristan da Cunha',
+    'SI': 'Republic of Slovenia',
+    'SJ': 'Svalbard and Jan Mayen',
+    'SK': 'Slovak Republic',
+    'SL': 'Republic of Sierra Leone',
+    'SM': 'Republic of San Marino',
+    'SN': 'Republic of Senegal',
+    'SO': 'Federal Republic of Somalia',
+    'SR': 'Republic of Suriname',
+    'SS': 'Republic of South Sudan',
+    'ST': 'Democratic Republic of Sao Tome and Principe',
+    'SV': 'Republic of El Salvador',
+    'SX': 'Sint Maarten (Dutch part)',
+    'SY': 'Syrian Arab Republic',
+    'SZ': 'Kingdom of Eswatini',
+    'TC': 'Turks and Caicos Islands',
+    'TD': 'Republic of Chad',
+    'TF': 'French Southern Territories',
+    'TG': 'Togolese Republic',
+    'TH': 'Kingdom of Thailand',
+    'TJ': 'Republic of Tajikistan',
+    'TK': 'Tokelau',
+    'TL': 'Democratic Republic of Timor-Leste',
+    'TM': 'Turkmenistan',
+    'TN': 'Republic of Tunisia',
+    'TO': 'Kingdom of Tonga',
+    'TR': 'Republic of Türkiye',
+    'TT': 'Republic of Trinidad and Tobago',
+    'TV': 'Tuvalu',
+    'TW': 'Taiwan, Province of China',
+    'TZ': 'United Republic of Tanzania',
+    'UA': 'Ukraine',
+    'UG': 'Republic of Uganda',
+    'UM': 'United States Minor Outlying Islands',
+    'US': 'United States of America',
+    'UY': 'Eastern Republic of Uruguay',
+    'UZ': 'Republic of Uzbekistan',
+    'VA': 'Holy See (Vatican City State)',
+    'VC': 'Saint Vincent and the Grenadines',
+    'VE': 'Bolivarian Republic of Venezuela',
+    'VG': 'British Virgin Islands',
+    'VI': 'Virgin Islands of the United States',
+    'VN': 'Socialist Republic of Viet Nam',
+    'VU': 'Republic of Vanuatu',
+    'WF': 'Wallis and Futuna',
+    'WS': 'Independent State of Samoa',
+    'YE': 'Republic of Yemen',
+    'YT': 'Mayotte',
+    'ZA': 'Republic of South Africa',
+    'ZM': 'Republic of Zambia',
+    'ZW': 'Republic of Zimbabwe',
+})
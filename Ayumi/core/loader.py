@@ -0,0 +1,126 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+import pathlib
+import asyncio
+import importlib
+import concurrent.futures
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from discord.ext import commands
+
+MAX_IMPORT_WORKERS = 4
+
+# Rarely used extensions, only loaded the first time one of their commands is invoked
+LAZY_EXTENSIONS = {
+    "jishaku": ("jishaku", "jsk"),
+}
+
+
+class ExtensionTiming(NamedTuple):
+    name: str
+    import_time: float = 0.0
+    setup_time: float = 0.0
+    error: Optional[Exception] = None
+
+
+def find_extensions(directory: str = './extensions') -> List[str]:
+    return sorted(
+        '.'.join(file.parts[:-1]) + '.' + file.stem
+        for file in pathlib.Path(directory).glob('**/*.py')
+    )
+
+
+def _timed_import(name: str) -> float:
+    start = time.perf_counter()
+    importlib.import_module(name)
+    return time.perf_counter() - start
+
+
+def preimport(names: Iterable[str], loop: asyncio.AbstractEventLoop) -> Dict[str, asyncio.Future]:
+    """
+    Imports the extensions and their dependencies on a thread pool,
+    load_extension executes the extension again but finds its dependencies already imported
+
+    Our extensions don't do anything but define things at import, which is what makes it safe,
+    the import system has per-module locks so shared dependencies are only imported once
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(MAX_IMPORT_WORKERS, thread_name_prefix="preimport")
+    futures = {name: loop.run_in_executor(executor, _timed_import, name) for name in names}
+    executor.shutdown(wait=False)
+    return futures
+
+
+async def load_extensions(bot: commands.Bot, futures: Dict[str, asyncio.Future]) -> List[ExtensionTiming]:
+    """Runs the setups one after another on the loop, as discord.py expects"""
+    timings = []
+
+    for name, future in futures.items():
+        try:
+            import_time = await future
+        except Exception as e:
+            timings.append(ExtensionTiming(name, error=e))
+            continue
+
+        start = time.perf_counter()
+        try:
+            bot.load_extension(name)
+        except Exception as e:
+            timings.append(ExtensionTiming(name, import_time, error=e))
+        else:
+            timings.append(ExtensionTiming(name, import_time, time.perf_counter() - start))
+
+    return timings
+
+
+def add_lazy_extension(bot: commands.Bot, extension: str, name: str, *aliases: str):
+    """
+    Adds a placeholder command that loads the extension, then processes the message again,
+    the real command gets invoked normally, its checks included
+    """
+    @commands.is_owner()  # nobody else can make us load them
+    async def load_and_retry(ctx: commands.Context, *, _: str = ''):
+        bot.remove_command(name)
+        start = time.perf_counter()
+        try:
+            bot.load_extension(extension)
+        except Exception:
+            bot.add_command(placeholder)
+            raise
+
+        bot.logger.info("Lazily loaded %s in %.1fms", extension, (time.perf_counter() - start) * 1000)
+        await bot.process_commands(ctx.message)
+
+    placeholder = commands.Command(load_and_retry, name=name, aliases=list(aliases), hidden=True)
+    bot.add_command(placeholder)
+
+
+def format_timings(timings: List[ExtensionTiming], total: float) -> str:
+    """A table of how long each extension took to import and to setup, in ms"""
+    width = max(len('total (wall)'), *(len(timing.name) for timing in timings))
+    lines = [f"{'extension':<{width}} {'import':>8} {'setup':>8}"]
+
+    for timing in sorted(timings, key=lambda timing: timing.import_time + timing.setup_time, reverse=True):
+        if timing.error is not None:
+            lines.append(f"{timing.name:<{width}} failed: {timing.error!r}")
+        else:
+            lines.append(f"{timing.name:<{width}} {timing.import_time * 1000:>8.1f} {timing.setup_time * 1000:>8.1f}")
+
+    lines.append(f"{'total (wall)':<{width}} {total * 1000:>17.1f}")
+    return '\n'.join(lines)
@@ -16,16 +16,22 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import json
+import random
 import asyncio
 import datetime
 import logging
-from typing import List
+import traceback
+import itertools
+import collections
+from typing import Dict, List, Optional, Tuple
 
+import aiohttp
 import discord
-from discord.ext import commands
 
 import utils
 from . import bot
+from . import spool
 
 COLORS = {
     "DEBUG": discord.Color.blue(),
@@ -38,53 +44,459 @@ COLORS = {
 NEED_FULL_MESSAGE = {"ERROR", "CRITICAL"}
 MAGNIFYING_GLASS = "\U0001f50e"
 
+# https://discord.com/developers/docs/resources/channel#embed-limits
+MAX_EMBEDS = 10
+MAX_EMBEDS_SIZE = 6000
+
+FLUSH_INTERVAL = 1  # how long a burst gets to pile up before being sent
+MAX_FLUSH_INTERVAL = 30
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1
+MAX_OUTAGE_BACKOFF = 300
+REPLAY_BATCH = 5  # spooled messages sent per flush, so new records keep moving to the spool
+
+# What's waiting to be sent is bounded, the least important records make room first
+
+MAX_PENDING_RECORDS = 500
+MAX_PENDING_SIZE = 2 * 1024 * 1024  # characters of formatted messages
+MAX_INBOX_RECORDS = 10_000  # records handed over by emit that the loop hasn't picked up yet
+ALWAYS_KEPT_LEVEL = logging.ERROR  # never sampled out
+
+DROPPED_TEMPLATE = "{0} records were dropped since the last report ({1})"
+
+
+class WebhookUnavailable(Exception):
+    """The webhook couldn't be reached after all the retries"""
+
+
+class _Pending:
+    """A record waiting to be sent, its embed is only built right before that"""
+    __slots__ = ('seq', 'record', 'message', 'count')
+
+    def __init__(self, seq: int, record: logging.LogRecord, message: str):
+        self.seq = seq
+        self.record = record
+        self.message = message
+        self.count = 1
+
 
 class WebhookHandler(logging.Handler):
-    def __init__(self, bot: bot.Bot, *, level: int = logging.NOTSET):
+    """
+    Sends the records to the log channel, identical records waiting
+    to be sent are merged, then packed in as few messages as the limits allow
+
+    Records wait in one FIFO per level, once full the oldest record
+    of the lowest level makes room, as long as it isn't above the new one
+
+    emit can be called from any thread, it only appends the record to an inbox,
+    which the event loop drains in batches, everything else happens on the loop
+
+    With a spool, every message is written to it before being sent,
+    so an outage only grows the spool, and the next process sends what's left
+    """
+    def __init__(self,
+                 bot: bot.Bot, *,
+                 level: int = logging.NOTSET,
+                 sampling: Optional[Dict[str, float]] = None,
+                 max_records: int = MAX_PENDING_RECORDS,
+                 max_size: int = MAX_PENDING_SIZE,
+                 spool: Optional[spool.Spool] = None):
         super().__init__(level)
+        self.spool = spool
         self.webhook = bot.webhook
         self.bot = bot
         self.loop = bot.loop
-        self.queue = asyncio.Queue() 
+        self.sampling = sampling or {}  # logger name: fraction of records kept
+        self.max_records = max_records
+        self.max_size = max_size
+        self.pending: Dict[int, collections.OrderedDict] = {}  # level: {key: _Pending}
+        self.pending_records = 0
+        self.pending_size = 0
+        self.flush_interval = FLUSH_INTERVAL
+        self.resume_at = 0.0
+        self.replay_at = 0.0
+        self.outage_backoff = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.sampled_out = 0
+        self.dropped = collections.Counter()  # level name: amount
+        self._reported_dropped = 0
+        self._sample_rates = {}
+        self.inbox_overflow = 0
+        self._inbox: List[logging.LogRecord] = []  # guarded by self.lock
+        self._drain_scheduled = False
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
         coro = self.send_webhooks()
         self.loop.create_task(coro)
 
+    @property
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending_records,
+            "pending_size": self.pending_size,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "sampled_out": self.sampled_out,
+            "dropped": dict(self.dropped),
+            "inbox_overflow": self.inbox_overflow,
+            "spool_size": self.spool.size if self.spool is not None else 0,
+        }
+
+    # Formatting, only done in the sender
+
+    @staticmethod
+    def format_embed(entry: _Pending) -> discord.Embed:
+        record = entry.record
+        embed = utils.LongEmbed(
+            title="[{0.levelname}] handled by {0.filename} in {0.funcName}".format(record),
+            color=COLORS.get(record.levelname),
+            timestamp=datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc),
+            description=entry.message,
+            prefix="```py"
+        )
+
+        if entry.count > 1:
+            embed.set_footer(text=f"Repeated {entry.count} times")
+
+        return embed
+
+    def format_dropped(self) -> Optional[discord.Embed]:
+        """A summary of what got dropped since the last one"""
+        total = sum(self.dropped.values())
+        if total == self._reported_dropped:
+            return None
+
+        details = ', '.join(f"{name}: {amount}" for name, amount in self.dropped.items())
+        self._reported_dropped = total
+        return discord.Embed(
+            title="Log records dropped",
+            color=COLORS["WARNING"],
+            description=DROPPED_TEMPLATE.format(total, details),
+        )
+
+    # Sending
+
+    def _pop_oldest(self) -> Optional[_Pending]:
+        """The oldest record overall, levels are only looked at to keep the order"""
+        heads = [(next(iter(entries.values())), level) for level, entries in self.pending.items() if entries]
+        if not heads:
+            return None
+        _, level = min(heads, key=lambda head: head[0].seq)
+        return self._remove(level)
+
+    def _remove(self, level: int) -> _Pending:
+        """Pops the oldest record of a level"""
+        _, entry = self.pending[level].popitem(last=False)
+        self.pending_records -= 1
+        self.pending_size -= len(entry.message)
+        return entry
+
+    def take_batch(self) -> List[discord.Embed]:
+        """Pops as many embeds as a single message can hold"""
+        embeds = []
+        size = 0
+
+        if (dropped := self.format_dropped()) is not None:
+            embeds.append(dropped)
+            size += len(dropped)
+
+        while self.pending_records and len(embeds) < MAX_EMBEDS:
+            entry = self._pop_oldest()
+            embed = self.format_embed(entry)
+            self.fit_embed(embed)
+
+            if embeds and size + len(embed) > MAX_EMBEDS_SIZE:
+                self._requeue(entry)
+                break
+
+            embeds.append(embed)
+            size += len(embed)
+
+        return embeds
+
+    def _requeue(self, entry: _Pending):
+        """Puts back an entry that didn't fit, in front of its level"""
+        key = self.coalesce_key(entry.record, entry.message)
+        entries = self.pending.setdefault(entry.record.levelno, collections.OrderedDict())
+        entries[key] = entry
+        entries.move_to_end(key, last=False)
+        self.pending_records += 1
+        self.pending_size += len(entry.message)
+
+    @staticmethod
+    def fit_embed(embed: discord.Embed):
+        """Long tracebacks are cut from the end until the embed fits on its own"""
+        while len(embed) > MAX_EMBEDS_SIZE and embed.fields:
+            embed.remove_field(len(embed.fields) - 1)
+
+    def read_rate_limit(self, headers) -> Optional[float]:
+        """Spreads the remaining requests over the bucket's reset, returns a pause if we must take one"""
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_after = float(headers["X-RateLimit-Reset-After"])
+        except (KeyError, ValueError):
+            return None
+
+        interval = reset_after / (remaining + 1)
+        self.flush_interval = min(max(FLUSH_INTERVAL, interval), MAX_FLUSH_INTERVAL)
+        return reset_after if remaining == 0 else None
+
+    @staticmethod
+    def make_payload(embeds: List[discord.Embed]) -> dict:
+        return {"embeds": [embed.to_dict() for embed in embeds]}
+
+    async def post(self, payload: dict) -> bool:
+        """
+        Sends a message, retrying with backoff, returns whether it got delivered,
+        raises WebhookUnavailable if we never got an answer
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            if (delay := self.resume_at - self.loop.time()) > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                async with self.bot.session.post(self.webhook.url, json=payload) as r:
+                    status, headers = r.status, r.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(BACKOFF_BASE * 2 ** attempt)
+                continue
+
+            if pause := self.read_rate_limit(headers):
+                self.resume_at = self.loop.time() + pause
+
+            if status < 300:
+                return True
+
+            if status == 429:
+                retry_after = headers.get("Retry-After")
+                try:
+                    pause = float(retry_after)
+                except (TypeError, ValueError):
+                    pause = BACKOFF_BASE * 2 ** attempt
+                self.resume_at = max(self.resume_at, self.loop.time() + pause)
+                continue
+
+            if status >= 500:
+                await asyncio.sleep(BACKOFF_BASE * 2 ** attempt)
+                continue
+
+            return False  # a bad request isn't going to get better
+
+        raise WebhookUnavailable()
+
+    async def deliver(self, payload: dict):
+        """Sends a message and counts the embeds, only lets WebhookUnavailable through"""
+        amount = len(payload["embeds"])
+        try:
+            delivered = await self.post(payload)
+        except WebhookUnavailable:
+            raise
+        except Exception:
+            traceback.print_exc()  # logging it would feed it back to us
+            delivered = False
+
+        if delivered:
+            self.sent += amount
+        else:
+            self.failed += amount
+
+    def _spool_failed(self):
+        """The disk is full or the spool got deleted, messages are sent directly from now on"""
+        traceback.print_exc()  # logging it would feed it back to us
+        spool, self.spool = self.spool, None
+        if spool is not None:
+            try:
+                spool.close()
+            except OSError:
+                pass
+
+    def spool_payload(self, payload: dict) -> bool:
+        """Returns whether the message got spooled, it has to be sent directly otherwise"""
+        if self.spool is None:
+            return False
+
+        try:
+            self.spool.append(json.dumps(payload, separators=(',', ':')).encode())
+        except OSError:
+            self._spool_failed()
+            return False
+
+        return True
+
+    async def replay(self):
+        """Sends the spool's messages in order, stops at the first outage"""
+        try:
+            await self._replay(self.spool)
+        except OSError:
+            self._spool_failed()
+
+    async def _replay(self, spool: spool.Spool):
+        for _ in range(REPLAY_BATCH):
+            if (raw := spool.peek()) is None:
+                return
+
+            try:
+                payload = json.loads(raw)
+            except ValueError:
+                spool.pop()
+                continue
+
+            try:
+                await self.deliver(payload)
+            except WebhookUnavailable:
+                self.outage_backoff = min(max(self.outage_backoff * 2, BACKOFF_BASE), MAX_OUTAGE_BACKOFF)
+                self.replay_at = self.loop.time() + self.outage_backoff
+                return
+
+            # Closed while we were sending, the message stays spooled and is sent again next time
+            if self.spool is not spool:
+                return
+
+            self.outage_backoff = 0
+            spool.pop()
+
     async def send_webhooks(self):
         """
         Sends webhooks to the log channel,
         tries to send them in one message if possible
         """
         while not self.bot.is_closed():
-            embed = await self.queue.get()
-            embeds = [embed]
+            if not self.pending_records and not self.spool:
+                self._ready.clear()
+                await self._ready.wait()
+
+            await asyncio.sleep(self.flush_interval)
+
+            if embeds := self.take_batch():
+                payload = self.make_payload(embeds)
+
+                if not self.spool_payload(payload):
+                    try:
+                        await self.deliver(payload)
+                    except WebhookUnavailable:
+                        self.failed += len(embeds)
+                    continue
+
+            if self.spool is not None and self.loop.time() >= self.replay_at:
+                await self.replay()
+
+    def close(self):
+        """What's still in memory is spooled for the next process"""
+        if self.spool is not None:
+            self.drain()
+            while self.spool is not None and (embeds := self.take_batch()):
+                self.spool_payload(self.make_payload(embeds))
+
+            # A replay might still be sending, it sees the spool is gone and leaves it alone
+            spool, self.spool = self.spool, None
+            if spool is not None:
+                spool.close()
 
-            await asyncio.sleep(1)
-            
-            queue_size = self.queue.qsize()
-            
-            amount_to_get = min(queue_size, 9)
+        super().close()
 
-            for _ in range(amount_to_get):
-                embed = self.queue.get_nowait()
-                embeds.append(embed)
-            
-            await self.webhook.send(embeds=embeds)
+    # Receiving
 
+    @staticmethod
+    def coalesce_key(record: logging.LogRecord, formatted: str) -> Tuple:
+        return (record.levelno, record.pathname, record.lineno, formatted)
+
+    def sample_rate(self, name: str) -> float:
+        """The closest configured parent wins, "discord" covers "discord.gateway" """
+        try:
+            return self._sample_rates[name]
+        except KeyError:
+            pass
+
+        rate = 1.0
+        parts = name.split('.')
+        for end in range(len(parts), 0, -1):
+            if (configured := self.sampling.get('.'.join(parts[:end]))) is not None:
+                rate = configured
+                break
+
+        self._sample_rates[name] = rate
+        return rate
+
+    def make_room(self, level: int, size: int) -> bool:
+        """Drops lower (or equal) level records until the new one fits, returns whether it does"""
+        if size > self.max_size:
+            return False
+
+        while (self.pending_records + 1 > self.max_records
+               or self.pending_size + size > self.max_size):
+            lowest = min((lvl for lvl, entries in self.pending.items() if entries), default=None)
+
+            if lowest is None or lowest > level:
+                return False
+
+            dropped = self._remove(lowest)
+            self.dropped[dropped.record.levelname] += dropped.count
+
+        return True
 
     def emit(self, record: logging.LogRecord):
         """
-        Formats the record then sends it
+        Hands the record over to the event loop, called with self.lock held
+        so it's safe from any thread, nothing here touches asyncio objects
+
+        The message is formatted here like QueueHandler.prepare does,
+        args can be mutable and change before the loop gets to them
         """
-        paginator = commands.Paginator(prefix="```py")
-        formatted = record.msg % record.args
+        if record.levelno < ALWAYS_KEPT_LEVEL and random.random() >= self.sample_rate(record.name):
+            self.sampled_out += 1
+            return
 
-        embed = utils.LongEmbed(
-            title="[{0.levelname}] handled by {0.filename} in {0.funcName}".format(record),
-            color=COLORS.get(record.levelname),
-            timestamp=datetime.datetime.now(datetime.timezone.utc),
-            description=formatted,
-            prefix="```py"
-        )
+        if len(self._inbox) >= MAX_INBOX_RECORDS:
+            self.inbox_overflow += 1
+            return
+
+        record.msg = record.getMessage()
+        record.args = None
+        self._inbox.append(record)
+
+        # A single wakeup per batch, however many records come in meanwhile
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            try:
+                self.loop.call_soon_threadsafe(self.drain)
+            except RuntimeError:  # the loop is closed, nobody is going to send them
+                self._inbox.clear()
+                self._drain_scheduled = False
+
+    def drain(self):
+        """Runs on the loop, takes everything emit handed over"""
+        with self.lock:
+            records, self._inbox = self._inbox, []
+            self._drain_scheduled = False
+
+        for record in records:
+            try:
+                self.enqueue(record)
+            except Exception:
+                self.handleError(record)
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Queues the record unless the same one is already waiting,
+        the embed is built by the sender
+        """
+        formatted = record.msg
+        key = self.coalesce_key(record, formatted)
+        entries = self.pending.setdefault(record.levelno, collections.OrderedDict())
+
+        if (entry := entries.get(key)) is not None:
+            entry.count += 1
+            self.coalesced += 1
+            return
 
-        self.queue.put_nowait(embed)
+        if not self.make_room(record.levelno, len(formatted)):
+            self.dropped[record.levelname] += 1
+            return
 
+        entries[key] = _Pending(next(self._seq), record, formatted)
+        self.pending_records += 1
+        self.pending_size += len(formatted)
+        self._ready.set()
@@ -0,0 +1,207 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Hashable
+
+import discord
+
+if TYPE_CHECKING:  # only the extensions need it at runtime, it's imported alongside them
+    from discord.ext import menus
+
+WHEEL_SLOTS = 64
+WHEEL_RESOLUTION = 1.0  # seconds per slot
+MAX_PENDING_EVENTS = 8  # reactions waiting to be handled, per session
+
+
+class TimerWheel:
+    """
+    A hashed timing wheel, scheduling and cancelling are O(1)
+    and every tick only looks at the items that landed in its slot
+    """
+    def __init__(self, *, slots: int = WHEEL_SLOTS, resolution: float = WHEEL_RESOLUTION):
+        self.resolution = resolution
+        self._slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[Hashable, float] = {}
+        self._tick = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def _slot_of(self, deadline: float) -> Set[Hashable]:
+        return self._slots[int(deadline // self.resolution) % len(self._slots)]
+
+    def schedule(self, item: Hashable, deadline: float):
+        """Adds an item, or moves it if it was already scheduled"""
+        self.discard(item)
+        self._deadlines[item] = deadline
+        self._slot_of(deadline).add(item)
+
+    def discard(self, item: Hashable):
+        if (deadline := self._deadlines.pop(item, None)) is not None:
+            self._slot_of(deadline).discard(item)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Pops every item whose deadline has passed, items from later rounds stay in place"""
+        current = int(now // self.resolution)
+        previous = current - 1 if self._tick is None else self._tick
+        self._tick = current
+
+        # After a long pause every slot needs to be looked at, but only once
+        ticks = range(max(previous + 1, current - len(self._slots) + 1), current + 1)
+        expired = []
+
+        for tick in ticks:
+            slot = self._slots[tick % len(self._slots)]
+            due = [item for item in slot if self._deadlines[item] <= now]
+            for item in due:
+                slot.discard(item)
+                del self._deadlines[item]
+            expired.extend(due)
+
+        return expired
+
+
+class MenuSession:
+    """The state the registry holds for a running menu"""
+    __slots__ = ('menu', 'message_id', 'queue', 'dropped')
+
+    def __init__(self, menu: "menus.Menu"):
+        self.menu = menu
+        self.message_id = menu.message.id
+        self.queue = asyncio.Queue()
+        self.dropped = 0
+
+    def feed(self, payload: discord.RawReactionActionEvent) -> bool:
+        """Queues a reaction, spamming one past the limit just drops it"""
+        if self.queue.qsize() >= MAX_PENDING_EVENTS:
+            self.dropped += 1
+            return False
+        self.queue.put_nowait(payload)
+        return True
+
+    def expire(self):
+        """Wakes the menu up with None, which means it timed out"""
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[discord.RawReactionActionEvent]:
+        return await self.queue.get()
+
+
+class MenuRegistry:
+    """
+    Routes reactions to the menus by message id,
+    instead of each menu having its own wait_for listener that checks every reaction
+    """
+    def __init__(self, bot, *, slots: int = WHEEL_SLOTS, resolution: float = WHEEL_RESOLUTION):
+        self.bot = bot
+        self.sessions: Dict[int, MenuSession] = {}
+        self.wheel = TimerWheel(slots=slots, resolution=resolution)
+        self.expired = 0
+        self._ticker = None
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def open(self, menu: "menus.Menu") -> MenuSession:
+        """Registers a menu, its message must have been sent already"""
+        session = MenuSession(menu)
+        self.sessions[session.message_id] = session
+        self.touch(session)
+
+        if self._ticker is None or self._ticker.done():
+            self._ticker = self.bot.loop.create_task(self._tick())
+
+        return session
+
+    def close(self, session: MenuSession):
+        if self.sessions.get(session.message_id) is session:
+            del self.sessions[session.message_id]
+        self.wheel.discard(session)
+
+    def touch(self, session: MenuSession):
+        """Pushes back the session's timeout"""
+        self.wheel.schedule(session, self.bot.loop.time() + session.menu.timeout)
+
+    def dispatch(self, payload: discord.RawReactionActionEvent):
+        """Called on every raw reaction event, a single dict lookup for unrelated messages"""
+        if (session := self.sessions.get(payload.message_id)) is None:
+            return
+
+        if session.menu.reaction_check(payload) and session.feed(payload):
+            self.touch(session)
+
+    async def _tick(self):
+        """Expires sessions, stops by itself once nothing is open"""
+        while self.sessions:
+            await asyncio.sleep(self.wheel.resolution)
+            for session in self.wheel.advance(self.bot.loop.time()):
+                self.expired += 1
+                session.expire()
+
+    def __repr__(self) -> str:
+        return f"<MenuRegistry sessions={len(self)} expired={self.expired}>"
+
+
+class RegisteredMenu:
+    """
+    A mixin for menus.Menu, the menu gets its reactions from the bot's registry
+    instead of wait_for, the interactions themselves are unchanged
+    """
+    async def _update(self, payload: discord.RawReactionActionEvent):
+        try:
+            await self.update(payload)
+        except Exception as e:
+            self.bot.dispatch("error", "Menu update", exception=e)
+
+    async def _internal_loop(self):
+        registry = self.bot.menus
+        session = registry.open(self)
+        timed_out = False
+
+        try:
+            while self._running:
+                if (payload := await session.get()) is None:
+                    timed_out = True
+                    break
+
+                # In its own task like menus.Menu does, a button calling stop()
+                # cancels this one, which must not happen while the button runs
+                self.bot.loop.create_task(self._update(payload))
+
+        finally:
+            registry.close(session)
+            self._event.set()
+
+            try:
+                await self.finalize(timed_out)
+            except Exception:
+                pass
+
+            # Can't do any requests if the bot is closed
+            if self.bot.is_closed():
+                return
+
+            try:
+                if self.delete_message_after:
+                    return await self.message.delete()
+
+                if self.clear_reactions_after and self._can_remove_reactions:
+                    return await self.message.clear_reactions()
+            except discord.HTTPException:
+                pass
@@ -0,0 +1,217 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import zlib
+import struct
+import pathlib
+from typing import List, Optional, Tuple, Union
+
+SEGMENT_SIZE = 1024 * 1024
+MAX_SPOOL_SIZE = 32 * 1024 * 1024
+SEGMENT_SUFFIX = ".spool"
+CURSOR_FILE = "cursor"
+
+# Every record is prefixed by its length and its crc32
+HEADER = struct.Struct(">II")
+
+
+class Spool:
+    """
+    An append-only queue of byte records on disk, split in segments
+
+    Records are read in order from a cursor that's saved every time one is popped,
+    segments get deleted once read, or once the spool goes over max_size (oldest first)
+
+    Every process writes in a new segment, a record torn by a crash
+    can only be at the end of a segment that nobody writes to anymore
+    """
+    def __init__(self,
+                 directory: Union[str, pathlib.Path], *,
+                 segment_size: int = SEGMENT_SIZE,
+                 max_size: int = MAX_SPOOL_SIZE):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.dropped_segments = 0
+        self.corrupted = 0
+
+        self.segments: List[int] = sorted(
+            int(path.stem) for path in self.directory.glob(f"*{SEGMENT_SUFFIX}") if path.stem.isdigit()
+        )
+        self.size = sum(self._path(index).stat().st_size for index in self.segments)
+
+        self._writer = None
+        self._reader = None
+        self._reader_segment = None
+        self._write_offset = 0
+        self._peeked: Optional[int] = None  # length of the record returned by peek
+
+        self.cursor = self._load_cursor()
+        self._rotate()
+
+        # The cursor's segment might be gone, reading goes on from the next one
+        if self.cursor[0] not in self.segments:
+            following = (index for index in self.segments if index > self.cursor[0])
+            self.cursor = (next(following, self.writing), 0)
+
+    # Files
+
+    def _path(self, index: int) -> pathlib.Path:
+        return self.directory / f"{index:010}{SEGMENT_SUFFIX}"
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            segment, offset = map(int, (self.directory / CURSOR_FILE).read_text().split())
+        except (OSError, ValueError):
+            segment, offset = 0, 0
+
+        if self.segments and segment < self.segments[0]:
+            return self.segments[0], 0
+
+        return segment, offset
+
+    def _save_cursor(self):
+        path = self.directory / CURSOR_FILE
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text("{0} {1}".format(*self.cursor))
+        os.replace(tmp_path, path)
+
+    def _rotate(self):
+        """Starts writing in a new segment"""
+        if self._writer is not None:
+            self._writer.close()
+
+        index = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(index)
+        self._writer = open(self._path(index), "ab")
+        self._write_offset = 0
+
+        if not self.segments[:-1]:  # nothing older to read
+            self.cursor = (index, 0)
+
+    def _delete(self, index: int):
+        if self._reader_segment == index:
+            self._reader.close()
+            self._reader = self._reader_segment = None
+
+        path = self._path(index)
+        try:
+            self.size -= path.stat().st_size
+            path.unlink()
+        except OSError:
+            pass
+
+        self.segments.remove(index)
+
+    def _next_segment(self):
+        """The cursor's segment was fully read, it can go"""
+        finished = self.cursor[0]
+        self.cursor = (self.segments[self.segments.index(finished) + 1], 0)
+        self._delete(finished)
+        self._save_cursor()
+
+    # Public api
+
+    @property
+    def writing(self) -> int:
+        return self.segments[-1]
+
+    def __bool__(self) -> bool:
+        """Whether there might be something left to read"""
+        return self.cursor != (self.writing, self._write_offset)
+
+    def append(self, payload: bytes):
+        header = HEADER.pack(len(payload), zlib.crc32(payload))
+        self._writer.write(header + payload)
+        self._writer.flush()
+
+        written = HEADER.size + len(payload)
+        self._write_offset += written
+        self.size += written
+
+        if self._write_offset >= self.segment_size:
+            self._rotate()
+
+        # Over the limit, the oldest records are lost, even if they weren't read
+        while self.size > self.max_size and len(self.segments) > 1:
+            oldest = self.segments[0]
+            if self.cursor[0] == oldest:
+                self.cursor = (self.segments[1], 0)
+                self._peeked = None
+                self._save_cursor()
+            self._delete(oldest)
+            self.dropped_segments += 1
+
+    def peek(self) -> Optional[bytes]:
+        """The next record, it stays there until pop is called"""
+        while True:
+            segment, offset = self.cursor
+            is_writing = segment == self.writing
+
+            if is_writing and offset >= self._write_offset:
+                return None
+
+            if self._reader_segment != segment:
+                if self._reader is not None:
+                    self._reader.close()
+                self._reader = open(self._path(segment), "rb")
+                self._reader_segment = segment
+
+            self._reader.seek(offset)
+            header = self._reader.read(HEADER.size)
+
+            if len(header) == HEADER.size:
+                length, crc = HEADER.unpack(header)
+                payload = self._reader.read(length)
+
+                if len(payload) == length and zlib.crc32(payload) == crc:
+                    self._peeked = length
+                    return payload
+
+                self.corrupted += 1
+
+            # End of the segment, or a torn / corrupted record, the rest is skipped
+            if is_writing:
+                self.cursor = (segment, self._write_offset)
+                self._save_cursor()
+                return None
+
+            self._next_segment()
+
+    def pop(self):
+        """Moves past the record returned by peek"""
+        if self._peeked is None:
+            self.peek()
+            if self._peeked is None:
+                return
+
+        segment, offset = self.cursor
+        self.cursor = (segment, offset + HEADER.size + self._peeked)
+        self._peeked = None
+        self._save_cursor()
+
+    def close(self):
+        for file in (self._writer, self._reader):
+            if file is not None:
+                file.close()
+        self._writer = self._reader = self._reader_segment = None
+
+    def __repr__(self) -> str:
+        return "<Spool segments={0} size={1.size}/{1.max_size}>".format(len(self.segments), self)
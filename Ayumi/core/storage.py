@@ -0,0 +1,403 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+import bisect
+import functools
+import asyncio
+import logging
+import contextlib
+import collections
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+import asyncpg
+from discord.ext import commands
+
+FAILURE_THRESHOLD = 3  # consecutive connection failures before the circuit opens
+MIN_RECOVERY_DELAY = 1
+MAX_RECOVERY_DELAY = 60
+MAX_BUFFERED_WRITES = 1000
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_LABEL_LENGTH = 60
+REPORT_INTERVAL = 60 * 60  # seconds between two usage reports in the logs
+
+# Errors that mean the database is unreachable, not that the query is wrong
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError,
+)
+
+
+class StorageUnavailable(commands.CommandError):
+    def __str__(self):
+        return "Sorry ! The database isn't reachable at the moment, try again later"
+
+
+class CircuitBreaker:
+    """
+    Opens after some consecutive failures, calls are then refused right away
+    until whoever probes the service closes it again
+    """
+    def __init__(self, *, threshold: int = FAILURE_THRESHOLD):
+        self.threshold = threshold
+        self.failures = 0
+        self.is_open = False
+        self.opened = 0
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self) -> bool:
+        """Returns whether this failure just opened the circuit"""
+        self.failures += 1
+        if self.is_open or self.failures < self.threshold:
+            return False
+        self.is_open = True
+        self.opened += 1
+        return True
+
+    def close(self):
+        self.failures = 0
+        self.is_open = False
+
+
+class LatencyHistogram:
+    """Counts observations per bucket, the last bucket holds everything above the bounds"""
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def mean(self) -> float:
+        return self.total / count if (count := self.count) else 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket the quantile falls in, or the max if it's lower"""
+        if not (count := self.count):
+            return 0.0
+
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _BufferedWrite:
+    __slots__ = ('method', 'query', 'args', 'callback', 'key')
+
+    def __init__(self,
+                 method: str,
+                 query: str,
+                 args: tuple,
+                 callback: Optional[Callable[[Any], Any]],
+                 key: Optional[Hashable]):
+        self.method = method
+        self.query = query
+        self.args = args
+        self.callback = callback
+        self.key = key
+
+
+class Storage:
+    """
+    Wraps the asyncpg pool, it's falsy while the database is unreachable
+
+    Queries fail fast with StorageUnavailable while the circuit is open,
+    a single background task probes the database with backoff meanwhile,
+    then flushes the writes that were buffered during the outage
+    """
+    def __init__(self,
+                 connect: Callable[[], Awaitable[asyncpg.pool.Pool]], *,
+                 name: str,
+                 logger: logging.Logger,
+                 max_buffered: int = MAX_BUFFERED_WRITES):
+        self.connect = connect
+        self.name = name
+        self.logger = logger
+        self.pool: Optional[asyncpg.pool.Pool] = None
+        self.breaker = CircuitBreaker()
+        self.buffered = collections.deque()
+        self._buffered_keys: Set[Hashable] = set()
+        self.max_buffered = max_buffered
+        self.dropped_writes = 0
+        self.query_latency: Dict[str, LatencyHistogram] = collections.defaultdict(LatencyHistogram)
+        self.pool_wait = LatencyHistogram()
+        self.checkouts = 0
+        self.checked_out = 0
+        self._reported_checkouts = 0
+        self._recovery = None
+        self._reporter = None
+
+    def __bool__(self) -> bool:
+        return self.pool is not None and not self.breaker.is_open
+
+    def __repr__(self) -> str:
+        return "<Storage name={0.name} available={1} buffered={2}>".format(self, bool(self), len(self.buffered))
+
+    # Connection
+
+    async def start(self):
+        """Connects, or starts trying to in the background"""
+        self._reporter = asyncio.ensure_future(self._report_periodically())
+        try:
+            self.pool = await self.connect()
+        except Exception as e:
+            # Anything can come out of a connection attempt, none of it should stop the bot
+            self.logger.warning("Couldn't connect to %s (%r), retrying in the background", self.name, e,
+                                exc_info=not isinstance(e, CONNECTION_ERRORS))
+            self.breaker.is_open = True
+            self._start_recovery()
+        else:
+            self.logger.info("Connected to %s", self.name)
+
+    def _start_recovery(self):
+        if self._recovery is None or self._recovery.done():
+            self._recovery = asyncio.ensure_future(self._recover())
+
+    async def _probe(self):
+        if self.pool is None:
+            self.pool = await self.connect()
+        else:
+            await self.pool.fetchval("SELECT 1")
+
+    async def _recover(self):
+        """Probes with an exponential backoff until the database answers"""
+        delay = MIN_RECOVERY_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._probe()
+            except Exception as e:
+                if not isinstance(e, CONNECTION_ERRORS):
+                    self.logger.warning("Unexpected error while probing %s", self.name, exc_info=e)
+                delay = min(delay * 2, MAX_RECOVERY_DELAY)
+                continue
+
+            self.breaker.close()
+            self.logger.info("%s is reachable again, %s buffered writes to flush", self.name, len(self.buffered))
+            await self.flush()
+            return
+
+    def _failed(self, error: Exception):
+        if self.breaker.record_failure():
+            self.logger.warning("%s is unreachable (%s), failing fast until it's back", self.name, error)
+            self._start_recovery()
+
+    async def close(self):
+        for task in (self._recovery, self._reporter):
+            if task is not None:
+                task.cancel()
+        if self.pool is not None:
+            await self.pool.close()
+
+    # Instrumentation
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def query_label(query: str) -> str:
+        return ' '.join(query.split())[:QUERY_LABEL_LENGTH]
+
+    @contextlib.asynccontextmanager
+    async def _checkout(self) -> AsyncIterator[asyncpg.Connection]:
+        """pool.acquire(), timing how long we waited for a connection"""
+        start = time.perf_counter()
+        conn = await self.pool.acquire()
+        self.pool_wait.observe(time.perf_counter() - start)
+        self.checkouts += 1
+        self.checked_out += 1
+        try:
+            yield conn
+        finally:
+            self.checked_out -= 1
+            await self.pool.release(conn)
+
+    async def _report_periodically(self):
+        """Logs the report every REPORT_INTERVAL, unless the pool wasn't used meanwhile"""
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            if self.checkouts != self._reported_checkouts:
+                self._reported_checkouts = self.checkouts
+                self.logger.info("%s usage\n```\n%s```", self.name, self.report())
+
+    def report(self) -> str:
+        """A table of the pool's usage and of the queries' latencies, slowest first"""
+        def row(label: str, histogram: LatencyHistogram) -> str:
+            return "{0:<{width}} {1.count:>8} {2:>8.1f} {3:>8.1f} {4:>8.1f}".format(
+                label, histogram, histogram.mean * 1000,
+                histogram.quantile(.95) * 1000, histogram.max * 1000,
+                width=QUERY_LABEL_LENGTH
+            )
+
+        header = "{0:<{width}} {1:>8} {2:>8} {3:>8} {4:>8}".format(
+            "query", "calls", "mean ms", "p95 ms", "max ms", width=QUERY_LABEL_LENGTH
+        )
+        slowest = sorted(self.query_latency.items(), key=lambda item: item[1].total, reverse=True)
+        lines = [
+            f"checkouts: {self.checkouts}, checked out: {self.checked_out}, "
+            f"pool size: {self.pool.get_size() if self.pool is not None else 0}",
+            header,
+            row("(waiting for a connection)", self.pool_wait),
+            *(row(label, histogram) for label, histogram in slowest),
+        ]
+        return '\n'.join(lines)
+
+    # Queries
+
+    async def _call(self, method: str, query: str, *args, **kwargs) -> Any:
+        """
+        Runs a query on a connection of its own, asyncpg prepares it
+        once per connection and keeps it in the statement cache
+        """
+        if not self:
+            raise StorageUnavailable()
+
+        try:
+            async with self._checkout() as conn:
+                start = time.perf_counter()
+                result = await getattr(conn, method)(query, *args, **kwargs)
+                self.query_latency[self.query_label(query)].observe(time.perf_counter() - start)
+        except CONNECTION_ERRORS as e:
+            self._failed(e)
+            raise StorageUnavailable() from e
+
+        self.breaker.record_success()
+        return result
+
+    async def fetch(self, query: str, *args, **kwargs) -> list:
+        return await self._call("fetch", query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs) -> Optional[asyncpg.Record]:
+        return await self._call("fetchrow", query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        return await self._call("fetchval", query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        return await self._call("execute", query, *args, **kwargs)
+
+    async def executemany(self, query: str, args, **kwargs):
+        return await self._call("executemany", query, args, **kwargs)
+
+    def acquire(self) -> "_Acquire":
+        return _Acquire(self)
+
+    # Buffered writes
+
+    async def buffer(self,
+                     method: str,
+                     query: str,
+                     *args,
+                     callback: Optional[Callable[[Any], Any]] = None,
+                     key: Optional[Hashable] = None):
+        """
+        Runs a write now if we can, otherwise keeps it for when the database is back,
+        callback gets the result either way, the oldest writes are dropped past max_buffered
+
+        A write whose key is already buffered is ignored, so repeating it during an outage is harmless
+        """
+        if self:
+            try:
+                result = await self._call(method, query, *args)
+            except StorageUnavailable:
+                pass
+            else:
+                if callback is not None:
+                    callback(result)
+                return
+
+        if key is not None:
+            if key in self._buffered_keys:
+                return
+            self._buffered_keys.add(key)
+
+        if len(self.buffered) >= self.max_buffered:
+            self._pop_buffered()
+            self.dropped_writes += 1
+
+        self.buffered.append(_BufferedWrite(method, query, args, callback, key))
+
+    def _pop_buffered(self):
+        write = self.buffered.popleft()
+        self._buffered_keys.discard(write.key)
+
+    async def flush(self):
+        """Runs the buffered writes in order, stops if the database goes away again"""
+        while self.buffered and self:
+            write = self.buffered[0]
+            try:
+                result = await self._call(write.method, write.query, *write.args)
+            except StorageUnavailable:
+                return
+            except asyncpg.PostgresError:
+                self.logger.exception("Dropped a buffered write to %s", self.name)
+            else:
+                if write.callback is not None:
+                    try:
+                        write.callback(result)
+                    except Exception:
+                        self.logger.exception("Buffered write callback failed")
+
+            self._pop_buffered()
+
+
+class _Acquire:
+    """pool.acquire(), instrumented, with connection errors counted by the circuit breaker"""
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._context = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        if not self.storage:
+            raise StorageUnavailable()
+
+        self._context = self.storage._checkout()
+        try:
+            return await self._context.__aenter__()
+        except CONNECTION_ERRORS as e:
+            self.storage._failed(e)
+            raise StorageUnavailable() from e
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._context.__aexit__(exc_type, exc, tb)
+
+        if exc_type is not None and issubclass(exc_type, CONNECTION_ERRORS):
+            self.storage._failed(exc)
+            raise StorageUnavailable() from exc
+
+        if exc_type is None:
+            self.storage.breaker.record_success()
@@ -12,24 +12,22 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import json
+import asyncio
 import textwrap
 import itertools
-import operator
+import collections
+import functools
 import datetime as dt
-from typing import Tuple, Generator, Optional, List, Union
+from typing import Tuple, Optional, List, Union, Callable, Awaitable, Dict, Iterable
 
 import discord
-from discord.ext import commands, menus
-import pycountry
+from discord.ext import commands, menus, tasks
 
 import core
 import utils
 
-class AnilistError(commands.CommandError):
-    """Base class for anilist related errors"""
-
-
-class NoResultsError(AnilistError):
+class NoResultsError(core.AnilistError):
     def __init__(self, query: str):
         self.query = query
 
@@ -37,25 +35,34 @@ class NoResultsError(AnilistError):
         return f"Sorry ! I couldn't find any results for \"{self.query}\""
 
 
-class NoScheduleError(AnilistError):
+class NoScheduleError(core.AnilistError):
     def __str__(self):
         return f"Sorry ! I couldn't find today's schedule"
 
 
-class MediaPages(menus.MenuPages):
+MAX_RENDERED_PAGES = 30  # per menu, the least recently shown pages get formatted again
+
+
+class MediaPages(core.RegisteredMenu, menus.MenuPages):
     """
     Our main menu, able to dynamically add buttons according
-    to the list of ListPageSource that got provided
+    to the list of ListPageSource that got provided,
+    reactions are routed to it by the bot's menu registry
     """
     def __init__(
         self,
         *,
         main_source: menus.ListPageSource,
         extra_sources: Union[Tuple[menus.ListPageSource], tuple] = (),
+        fields_loader: Optional[Callable[[List[core.Media], utils.Fragment], Awaitable]] = None,
         **options,
     ):
 
         self.initial_source = main_source
+        self.fields_loader = fields_loader
+        self.loaded_sources = set()
+        self.headers = {}  # media id: shared header
+        self.render_cache = collections.OrderedDict()  # (source class, page index): message kwargs
         super().__init__(self.initial_source,
                          delete_message_after=True,
                          timeout=60,
@@ -76,10 +83,31 @@ class MediaPages(menus.MenuPages):
         emoji = str(payload.emoji)
         new_source = self.extra_sources[emoji]
         if self.source is self.initial_source or self.source is not new_source:
+            if not await self.load_fields(new_source):
+                return
             return await self.change_source(new_source)
         else:
             return await self.change_source(self.initial_source)
 
+    async def load_fields(self, source: menus.ListPageSource) -> bool:
+        """
+        Fetches the fields of lazy sources the first time they're shown,
+        for all entries at once, returns whether the source can be shown
+        """
+        if not getattr(source, "lazy", False) or type(source) in self.loaded_sources:
+            return True
+
+        if self.fields_loader is None:
+            return False
+
+        try:
+            await self.fields_loader(source.entries, source.fragment)
+        except core.AnilistError:
+            return False
+
+        self.loaded_sources.add(type(source))
+        return True
+
     async def change_source(self,
                             source: menus.ListPageSource, *,
                             at_index: Optional[int] = None,
@@ -99,6 +127,17 @@ class MediaPages(menus.MenuPages):
             await source._prepare_once()
             await self.show_page(at_index)
 
+    async def _get_kwargs_from_page(self, page: dict) -> dict:
+        """Each page of each source is only formatted once, flipping back is free"""
+        key = (type(self.source), self.current_page)
+        if (kwargs := self.render_cache.get(key)) is None:
+            kwargs = self.render_cache[key] = await super()._get_kwargs_from_page(page)
+            if len(self.render_cache) > MAX_RENDERED_PAGES:
+                self.render_cache.popitem(last=False)
+        else:
+            self.render_cache.move_to_end(key)
+        return kwargs
+
     async def update(self, payload: discord.RawReactionActionEvent):
         """Returns to the main page every time a movement button is pressed"""
         if str(payload.emoji) not in self.extra_sources:
@@ -121,9 +160,29 @@ class MediaPages(menus.MenuPages):
         """Same as go_to_previous_page"""
         return await super().go_to_next_page(payload)
 
-    #@menus.button("clock emote", position=menus.Last(2))
+    @menus.button("\U000023f0", position=menus.Last(2))  # alarm clock
     async def toggle_reminder(self, payload: discord.RawReactionActionEvent):
-        pass
+        """Toggles a reminder for the next episode of the current media"""
+        if not (cog := self.bot.get_cog("Reminders")):
+            return
+
+        media = await self.initial_source.get_page(self.current_page)
+        # The media might come from an old catalog entry, whose episode aired since
+        if not media.next_airing_at or media.next_airing_at <= dt.datetime.now(dt.timezone.utc):
+            return await self.ctx.send("This media has no upcoming episode", delete_after=10)
+
+        try:
+            added = await cog.scheduler.toggle(
+                user_id=payload.user_id,
+                trigger_time=media.next_airing_at,
+                anime_name=media.main_title,
+                channel_id=self.message.channel.id,
+            )
+        except core.StorageUnavailable as e:
+            return await self.ctx.send(str(e), delete_after=10)
+
+        content = ("Reminder removed", "I'll remind you once it airs")[added]
+        await self.ctx.send(content, delete_after=10)
 
 
 
@@ -135,76 +194,47 @@ class PresetSource(menus.ListPageSource):
 
 # Media search
 
-MEDIA_SEARCH = """
-query ($page: Int, $perPage: Int, $asHtml: Boolean, $characterSort: [CharacterSort], %s) {
+MEDIA_SEARCH = utils.GraphQLQuery("""
+query %(variables)s {
     Page (page: $page, perPage: $perPage) {
-        media (%s) {
-            id
-            isAdult
-            bannerImage
-            coverImage {
-                medium
-                extraLarge
-                color
-            }
-            title {
-                english
-                romaji
-                native
-            }
-            seasonYear
-            format
-            description (asHtml: $asHtml)
-            startDate {
-                day
-                month
-                year
-            }
-            endDate {
-                day
-                month
-                year
-            }
-            nextAiringEpisode {
-                airingAt
-            }
-            season
-            countryOfOrigin
-            status
-            source
-            episodes
-            duration
-            chapters
-            volumes
-            averageScore
-            popularity
-            favourites
-            hashtag
-            idMal
-            type
-            siteUrl
-            trailer {
-                site
-                id
-            }
-            streamingEpisodes {
-                title
-                site
-                url
-            }
-            characters (sort: $characterSort) {
-                nodes {
-                    name {
-                        full
-                        native
-                    }
-                    siteUrl
-                }
-            }
+        media %(arguments)s {
+            %(fields)s
         }
     }
 }
-"""
+""",
+    variables={"page": "Int", "perPage": "Int"},
+    filters={
+        "search": "String",
+        "sort": "[MediaSort]",
+        "isAdult": "Boolean",
+        "genre": "String",
+        "seasonYear": "Int",
+        "format": "MediaFormat",
+        "type": "MediaType",
+    },
+)
+
+# Fetching specific medias, each alias is a page of at most 50 ids
+
+MAX_PER_PAGE = 50
+MAX_ALIASES = 4
+BATCH_WINDOW = 0.05
+
+
+@functools.lru_cache(maxsize=64)
+def build_media_batch_query(aliases: int, fragments: Tuple[utils.Fragment, ...]) -> str:
+    """A query with one aliased page of medias per chunk of ids, $ids0, $ids1..."""
+    f_variables = ', '.join(f"$ids{i}: [Int]" for i in range(aliases))
+    f_fields = ' '.join(fragment.spread for fragment in fragments)
+    pages = ' '.join(
+        f"p{i}: Page (perPage: {MAX_PER_PAGE}) {{ media (id_in: $ids{i}) {{ id {f_fields} }} }}"
+        for i in range(aliases)
+    )
+    query = f"query ({f_variables}) {{ {pages} }}"
+    definitions = ''.join(fragment.definition for fragment in fragments)
+    return utils.minify_graphql(query) + definitions
+
 
 class InformationSource(PresetSource):
     """Provides informations on how to use the menu's buttons"""
@@ -231,6 +261,31 @@ class InformationSource(PresetSource):
 
 class TemplateMediaSource(PresetSource):
     """Main body that will always be there (title, images, timestamp)"""
+
+    # The graphql fields needed to format a page, lazy ones aren't
+    # in the initial query and get fetched when the source is first shown
+    fragment = utils.Fragment("MediaBase", "Media", """
+        id
+        isAdult
+        bannerImage
+        coverImage {
+            medium
+            extraLarge
+            color
+        }
+        title {
+            english
+            romaji
+            native
+        }
+        seasonYear
+        format
+        nextAiringEpisode {
+            airingAt
+        }
+    """)
+    lazy = False
+
     def __init__(self, *args, **kwargs):
         """
         Template, subclasses that aren't the front page
@@ -244,34 +299,47 @@ class TemplateMediaSource(PresetSource):
         return True
 
     @staticmethod
-    def format_title(data: dict) -> str:
+    def format_title(media: core.Media) -> str:
         """Formats the title used for the menu source"""
-        titles = operator.itemgetter("english", "romaji", "native")(data["title"])
-        main_title = next(filter(None, titles))
-        f_is_adult = "18+ " if data['isAdult'] else ''
-        f_season_year = f"({season_year})" if (season_year := data["seasonYear"]) else ''
-        return f"[{f_is_adult}{data['format']}] {main_title} {f_season_year}"
+        f_is_adult = "18+ " if media.is_adult else ''
+        f_season_year = f"({media.season_year})" if media.season_year else ''
+        return f"[{f_is_adult}{media.format}] {media.main_title} {f_season_year}"
+
+    def format_header(self, media: core.Media) -> dict:
+        """Everything in the embed that only depends on the media"""
+        is_template = self.__class__ is TemplateMediaSource
+        return {
+            "title": self.format_title(media),
+            "thumbnail": media.cover_large if is_template else media.cover_medium,
+            "color": media.color,
+            "image": media.banner,
+            "timestamp": media.next_airing_at,
+        }
 
-    async def format_page(self, menu: MediaPages, data: dict) -> utils.Embed:
+    def get_header(self, menu: MediaPages, media: core.Media) -> dict:
+        """The header is formatted once per media and shared by all of the menu's sources"""
+        if (header := menu.headers.get(media.id)) is None:
+            header = menu.headers[media.id] = self.format_header(media)
+        return header
+
+    async def format_page(self, menu: MediaPages, media: core.Media) -> utils.Embed:
         """Formats the media into a embed showing the main informations"""
-        embed = utils.Embed(title=self.format_title(data))
-        size = ("medium", "extraLarge")[self.__class__ is TemplateMediaSource]
-        if cover_img := data["coverImage"][size]:
+        header = self.get_header(menu, media)
+        embed = utils.Embed(title=header["title"])
+
+        if cover_img := header["thumbnail"]:
             embed.set_thumbnail(url=cover_img)
 
-        if color_hex := data['coverImage']['color']:
-            embed.color = int(color_hex[1:], 16)
+        if (color := header["color"]) is not None:
+            embed.color = color
 
-        if img_url := data["bannerImage"]:
+        if img_url := header["image"]:
             embed.set_image(url=img_url)
 
         footer = [f"Page {menu.current_page + 1} out of {self.get_max_pages()}"]
 
-        if next_airing_ep := data["nextAiringEpisode"]:
-            embed.timestamp = dt.datetime.fromtimestamp(
-                next_airing_ep["airingAt"],
-                tz=dt.timezone.utc
-            )
+        if timestamp := header["timestamp"]:
+            embed.timestamp = timestamp
             footer.append("Next airing in your timezone")
 
         author = menu.ctx.author
@@ -298,76 +366,76 @@ class TemplateMediaSource(PresetSource):
 
 class MediaSourceFront(TemplateMediaSource):
     """Main page that is shown to the user"""
+    fragment = utils.Fragment("MediaFront", "Media", """
+        description (asHtml: false)
+    """)
 
     def is_paginating(self) -> True:
         """Forcing pagination to always have buttons"""
         return True
 
-    async def format_page(self, menu: MediaPages, data: dict) -> utils.Embed:
+    async def format_page(self, menu: MediaPages, media: core.Media) -> utils.Embed:
         """Formats the media into a embed showing the main informations"""
-        embed = await super().format_page(menu, data)
-
-        if desc := data["description"]:
-            return embed(description=utils.remove_html_tags(desc))
-
-        return embed(description="No description provided")
+        embed = await super().format_page(menu, media)
+        return embed(description=media.description or "No description provided")
 
 
 class MediaSourceCalendar(TemplateMediaSource):
     """Airing informations, such as start and end date"""
+    fragment = utils.Fragment("MediaCalendar", "Media", """
+        startDate {
+            day
+            month
+            year
+        }
+        endDate {
+            day
+            month
+            year
+        }
+        season
+        countryOfOrigin
+        status
+        source
+    """)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.emoji = "\U0001f4c6"  # calendar
 
-    @staticmethod
-    def format_boundary_dates(data: dict) -> Generator[Tuple[Tuple[str, str]], None, None]:
-        prefixes = 'Start', 'End'
-        date_info_getter = operator.itemgetter("year", "month", "day")
-
-        for prefix, boundary in zip(prefixes, (data['startDate'], data['endDate'])):
-            date_info = date_info_getter(boundary)
-
-            if all(date_info):
-                date = dt.datetime(*date_info)
-                yield prefix, date.strftime("%A, %d %B %Y")
-
-            elif any(date_info):
-                filtered = [f"{d:02}" if d else '00' for d in reversed(date_info)]
-                yield prefix, '/'.join(filtered)
-
-            else:
-                yield prefix, '?'
-
-    async def format_page(self, menu: MediaPages, data: dict) -> utils.Embed:
+    async def format_page(self, menu: MediaPages, media: core.Media) -> utils.Embed:
         """Adds informations about airing"""
-        embed = await super().format_page(menu, data)
-        to_join = [*self.format_boundary_dates(data)]
+        embed = await super().format_page(menu, media)
+        to_join = [("Start", media.start_date or '?'), ("End", media.end_date or '?')]
 
-        if next_airing_ep := data["nextAiringEpisode"]:
-            airing_at = dt.datetime.fromtimestamp(next_airing_ep["airingAt"])
+        if airing_at := media.next_airing_at:
             f_airing_at = airing_at.strftime("%d %b %Y\n%H:%M UTC")
             to_join.append(("Next airing", f_airing_at))
 
-        if country_of_origin := data["countryOfOrigin"]:
-            country = pycountry.countries.get(alpha_2=country_of_origin)
-            f_country = getattr(country, "official_name", country.name)
-            to_join.append(("Country of origin", f_country))
+        if country := media.country:
+            to_join.append(("Country of origin", country))
 
-        if season := data["season"]:
-            to_join.append(("Season", season.lower().title()))
+        if season := media.season:
+            to_join.append(("Season", season))
 
-        if airing_status := data["status"]:
-            to_join.append(("Airing status", airing_status.lower().title()))
+        if airing_status := media.status:
+            to_join.append(("Airing status", airing_status))
 
-        if source := data["source"]:
-            f_source = source.replace('_', ' ').lower().title()
-            to_join.append(("Source", f_source))
+        if source := media.source:
+            to_join.append(("Source", source))
 
         return embed(description=self.join_data(to_join) or "No airing data")
 
 
 class MediaSourceStopwatch(TemplateMediaSource):
     """Estimate time to read / watch the media"""
+    fragment = utils.Fragment("MediaStopwatch", "Media", """
+        episodes
+        duration
+        chapters
+        volumes
+    """)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.emoji = "\U000023f1"
@@ -381,24 +449,24 @@ class MediaSourceStopwatch(TemplateMediaSource):
         time_components = filter(None, (f_hours, f_minutes))
         return " and ".join(time_components)
 
-    async def format_page(self, menu: MediaPages, data: dict) -> utils.Embed:
+    async def format_page(self, menu: MediaPages, media: core.Media) -> utils.Embed:
         """Adds infos about reading / watching time"""
-        embed = await super().format_page(menu, data)
+        embed = await super().format_page(menu, media)
         to_join = []
 
         watch_flag = 0
         read_flag = 0
 
-        if (episodes := data["episodes"]) and episodes > 1:
+        if (episodes := media.episodes) and episodes > 1:
             to_join.append(("Episodes", episodes))
             watch_flag += 1
 
-        if duration := data["duration"]:
+        if duration := media.duration:
             to_join.append(("Duration", self.human_duration(duration)))
             watch_flag += 1
 
         for item_name in ("chapters", "volumes"):
-            if item := data[item_name]:
+            if item := getattr(media, item_name):
                 to_join.append((item_name.title(), item))
                 read_flag += 1
 
@@ -418,6 +486,13 @@ class MediaSourceStopwatch(TemplateMediaSource):
 
 class MediaSourceSpeechBubble(TemplateMediaSource):
     """Shows user ratings"""
+    fragment = utils.Fragment("MediaSpeechBubble", "Media", """
+        averageScore
+        popularity
+        favourites
+        hashtag
+    """)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.emoji = "\U0001f4ac"
@@ -428,20 +503,20 @@ class MediaSourceSpeechBubble(TemplateMediaSource):
         url = utils.TWITTER_HASHTAG_URL.format(hashtag[1:])
         return f"[{hashtag}]({url})"
 
-    async def format_page(self, menu: MediaPages, data: dict):
-        embed = await super().format_page(menu, data)
+    async def format_page(self, menu: MediaPages, media: core.Media):
+        embed = await super().format_page(menu, media)
         to_join = []
 
-        if avg_score := data["averageScore"]:
+        if avg_score := media.average_score:
             to_join.append(("Average score", f"{avg_score}/100"))
 
-        if pop := data["popularity"]:
+        if pop := media.popularity:
             to_join.append(("Popularity", f"{pop} users have it on their list"))
 
-        if fav := data["favourites"]:
+        if fav := media.favourites:
             to_join.append(("Favourites", f"{fav} users favourited it"))
 
-        if hashtags := data["hashtag"]:
+        if hashtags := media.hashtag:
             hashtag_list = hashtags.split()
             mapped = map(self.to_markdown_twitter_url, hashtag_list)
             to_join.append(("Hashtags", ' '.join(mapped)))
@@ -451,29 +526,44 @@ class MediaSourceSpeechBubble(TemplateMediaSource):
 
 class MediaSourceTelevision(TemplateMediaSource):
     """Links to watch / read the media"""
+    fragment = utils.Fragment("MediaTelevision", "Media", """
+        idMal
+        type
+        siteUrl
+        trailer {
+            site
+            id
+        }
+        streamingEpisodes {
+            title
+            site
+            url
+        }
+    """)
+    lazy = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.emoji = "\U0001f4fa"
 
     @staticmethod
-    def get_ep_line(ep: dict, pos_name: str):
+    def get_ep_line(ep: Tuple[str, str], pos_name: str):
         """A helper function to format episodes links"""
-        return "[{0} episode - {1[site]}]({1[url]})".format(pos_name, ep)
+        return "[{0} episode - {1[0]}]({1[1]})".format(pos_name, ep)
 
-    async def format_page(self, menu: MediaPages, data: dict):
-        embed = await super().format_page(menu, data)
+    async def format_page(self, menu: MediaPages, media: core.Media):
+        embed = await super().format_page(menu, media)
         to_join = []
 
-        if (media_type := data["type"]) and (mal_id := data["idMal"]):
+        if (media_type := media.type) and (mal_id := media.id_mal):
             url = utils.MAL_ANIME_ID_URL.format(media_type.lower(), mal_id)
             to_join.append(("MyAnimeList", f"[Jump url]({url})"))
 
-        if site_url := data["siteUrl"]:
-            to_join.append(("Anilist", f"[Jump url]({url})"))
+        if site_url := media.site_url:
+            to_join.append(("Anilist", f"[Jump url]({site_url})"))
 
-        if trailer := data["trailer"]:
-            id_ = trailer["id"]
-            site = trailer["site"]
+        if trailer := media.trailer:
+            site, id_ = trailer
             if site == "youtube":
                 url = utils.YOUTUBE_VIDEO_URL.format(id_)
             else:
@@ -481,10 +571,9 @@ class MediaSourceTelevision(TemplateMediaSource):
 
             to_join.append(("Trailer", f"[{site}]({url})"))
 
-        if streaming_episodes := data["streamingEpisodes"]:
-            last_ep, *_, first_ep = streaming_episodes
+        if media.first_episode:
             pos_names = ("First", "Latest")
-            eps = (first_ep, last_ep)
+            eps = (media.first_episode, media.latest_episode)
             f_eps = [self.get_ep_line(ep, pos_name) for ep, pos_name in zip(eps, pos_names)]
             to_join.append(("Links to episodes", '\n'.join(f_eps)))
 
@@ -493,109 +582,167 @@ class MediaSourceTelevision(TemplateMediaSource):
 
 class MediaSourceFamily(TemplateMediaSource):
     """Links to this show's characters"""
+    fragment = utils.Fragment("MediaFamily", "Media", """
+        characters (sort: FAVOURITES_DESC) {
+            nodes {
+                name {
+                    full
+                    native
+                }
+                siteUrl
+            }
+        }
+    """)
+    lazy = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.emoji = "\U0001f46a"
 
     @staticmethod
-    def format_characters(data: dict):
-        name = data["name"]
-        f_name = name["full"] or name["native"]
-        return f"[{f_name}]({data['siteUrl']})"
-
-    async def format_page(self, menu: MediaPages, data: dict):
-        embed = await super().format_page(menu, data)
-        joined = '\n'.join(map(self.format_characters, data["characters"]["nodes"]))
+    def format_characters(character: Tuple[str, str]):
+        return "[{0[0]}]({0[1]})".format(character)
+
+    async def format_page(self, menu: MediaPages, media: core.Media):
+        embed = await super().format_page(menu, media)
+        joined = '\n'.join(map(self.format_characters, media.characters or ()))
         to_join = (("Characters", joined),)
         return embed(description=self.join_data(to_join) or "No characters data")
 
 
-# This isn't dry at all, but it won't be fixed to keep readability up
-
-SCHEDULE_SEARCH = """
-query ($page: Int, $perPage: Int, $asHtml: Boolean, $airingSort: [AiringSort], $airingAfter: Int, \
-       $characterSort: [CharacterSort]) {
+SCHEDULE_SEARCH = utils.GraphQLQuery("""
+query %(variables)s {
     Page (page: $page, perPage: $perPage) {
         airingSchedules (airingAt_greater: $airingAfter, sort: $airingSort) {
             media {
-                id
-                isAdult
-                bannerImage
-                coverImage {
-                    medium
-                    extraLarge
-                    color
-                }
-                title {
-                    english
-                    romaji
-                    native
-                }
-                seasonYear
-                format
-                description (asHtml: $asHtml)
-                startDate {
-                    day
-                    month
-                    year
-                }
-                endDate {
-                    day
-                    month
-                    year
-                }
-                nextAiringEpisode {
-                    airingAt
-                }
-                season
-                countryOfOrigin
-                status
-                source
-                episodes
-                duration
-                chapters
-                volumes
-                averageScore
-                popularity
-                favourites
-                hashtag
-                idMal
-                type
-                siteUrl
-                trailer {
-                    site
-                    id
-                }
-                streamingEpisodes {
-                    title
-                    site
-                    url
-                }
-                characters (sort: $characterSort) {
-                    nodes {
-                        name {
-                            full
-                            native
-                        }
-                        siteUrl
-                    }
-                }
+                %(fields)s
             }
         }
     }
 }
+""",
+    variables={"page": "Int", "perPage": "Int", "airingSort": "[AiringSort]", "airingAfter": "Int"},
+)
+
+# Background ingestion of the next days' schedule, served from postgres afterwards
+
+SCHEDULE_INGEST = utils.GraphQLQuery("""
+query %(variables)s {
+    Page (page: $page, perPage: $perPage) {
+        pageInfo {
+            hasNextPage
+        }
+        airingSchedules (airingAt_greater: $airingAfter, airingAt_lesser: $airingBefore,
+                         sort: $airingSort) {
+            id
+            episode
+            airingAt
+            media {
+                %(fields)s
+            }
+        }
+    }
+}
+""",
+    variables={
+        "page": "Int",
+        "perPage": "Int",
+        "airingSort": "[AiringSort]",
+        "airingAfter": "Int",
+        "airingBefore": "Int",
+    },
+)
+
+INGEST_INTERVAL = 30  # minutes
+INGEST_DAYS = 7
+INGEST_MAX_PAGES = 40
+
+UPSERT_SCHEDULE = """
+INSERT INTO airing_schedules (id, media_id, episode, airing_at, is_adult, media, updated_at)
+VALUES ($1, $2, $3, $4, $5, $6::jsonb, $7)
+ON CONFLICT (id) DO UPDATE
+SET media_id = EXCLUDED.media_id,
+    episode = EXCLUDED.episode,
+    airing_at = EXCLUDED.airing_at,
+    is_adult = EXCLUDED.is_adult,
+    media = EXCLUDED.media,
+    updated_at = EXCLUDED.updated_at
+"""
+
+# Aired, or not in anilist's schedule anymore (postponed / cancelled)
+PRUNE_SCHEDULE = """
+DELETE FROM airing_schedules
+WHERE airing_at < $1 OR (airing_at < $2 AND updated_at < $3)
+"""
+
+LOCAL_SCHEDULE = """
+SELECT media FROM airing_schedules
+WHERE airing_at > $1 AND (NOT is_adult OR $2)
+ORDER BY airing_at
+LIMIT $3
+"""
+
+# Local catalog, the most popular medias get ingested daily,
+# everything that search gets from anilist is added on the fly
+
+SYNONYMS_FRAGMENT = utils.Fragment("MediaSynonyms", "Media", "synonyms")
+
+CATALOG_INTERVAL = dt.timedelta(hours=24)  # between two full ingestions
+CATALOG_CHECK_INTERVAL = 1  # hours
+CATALOG_MAX_PAGES = 200
+CATALOG_FRESHNESS = dt.timedelta(hours=6)
+HYDRATE_TIMEOUT = 3
+
+# Outdated as soon as the episode airs, an old catalog entry can't be trusted with them
+TIME_SENSITIVE_FIELDS = ("nextAiringEpisode",)
+
+LAST_INGESTION = "SELECT finished_at FROM ingestions WHERE name = $1"
+
+RECORD_INGESTION = """
+INSERT INTO ingestions (name, finished_at)
+VALUES ($1, now())
+ON CONFLICT (name) DO UPDATE
+SET finished_at = EXCLUDED.finished_at
+"""
+
+UPSERT_CATALOG = """
+INSERT INTO media_catalog (id, is_adult, popularity, titles, media, updated_at)
+VALUES ($1, $2, $3, $4, $5::jsonb, now())
+ON CONFLICT (id) DO UPDATE
+SET is_adult = EXCLUDED.is_adult,
+    popularity = EXCLUDED.popularity,
+    titles = EXCLUDED.titles,
+    media = EXCLUDED.media,
+    updated_at = EXCLUDED.updated_at
+"""
+
+# Only a close match to one of the titles is trusted, anything looser goes to anilist,
+# the catalog doesn't have every media
+LOCAL_MATCH_THRESHOLD = 0.8
+
+# <% uses the trigram index, the full text search catches reordered words,
+# score is the similarity to the closest title or synonym, 1 for an exact match
+LOCAL_SEARCH = """
+SELECT id, media, updated_at, coalesce((
+    SELECT max(similarity($1, title)) FROM unnest(string_to_array(titles, ' / ')) AS title
+), 0) AS score
+FROM media_catalog
+WHERE ($1 <% titles OR search_vector @@ plainto_tsquery('simple', $1))
+  AND (NOT is_adult OR $2)
+ORDER BY score DESC, word_similarity($1, titles) DESC, popularity DESC
+LIMIT $3
 """
 
 class Anilist(commands.Cog):
     def __init__(self, bot: core.Bot):
         self.bot = bot
-        self.url = "https://graphql.anilist.co"
+        local_cache = utils.TTLCache(max_size=CACHE_MAX_SIZE, default_ttl=MEDIA_SEARCH_TTL)
+        cache = utils.TieredCache(local_cache, bot.redis, prefix="ayumi:anilist:")
+        self.client = core.AnilistClient(bot.session, cache=cache)
         self.cooldown = commands.CooldownMapping.from_cooldown(1, 10, commands.BucketType.user)
         self.default_variables = {
             "page": 1,
             "perPage": 10,
-            "asHtml": False,
-            "characterSort": "FAVOURITES_DESC"
         }
         self.sources = (
             MediaSourceFront,
@@ -606,18 +753,267 @@ class Anilist(commands.Cog):
             MediaSourceTelevision,
             MediaSourceFamily,
         )
+        # Only what's needed for the non-lazy sources
+        eager_fragments = [Source.fragment for Source in self.sources
+                           if hasattr(Source, "fragment") and not Source.lazy]
+        self.front_fragments = (TemplateMediaSource.fragment, *eager_fragments)
+        self.catalog_fragments = (*self.front_fragments, SYNONYMS_FRAGMENT)
+        self.media_loaders = {}
+
+        # Runs are skipped while the database is down, a blip during one is retried
+        for loop in (self.ingest_schedule, self.ingest_catalog):
+            loop.add_exception_type(core.StorageUnavailable)
+            loop.start()
+
+    def cog_unload(self):
+        self.ingest_schedule.cancel()
+        self.ingest_catalog.cancel()
+        self.client.close()
+
+    async def make_request(self,
+                           query: str,
+                           variables: dict, *,
+                           ttl: Optional[float] = None,
+                           priority: core.Priority = core.Priority.INTERACTIVE,
+                           use_cache: bool = True) -> dict:
+        """Shortcut for the client, see AnilistClient.request"""
+        return await self.client.request(query, variables, ttl=ttl, priority=priority, use_cache=use_cache)
+
+    async def _load_media_batch(self,
+                                fragments: Tuple[utils.Fragment, ...],
+                                priority: core.Priority,
+                                ids: List[int]) -> Dict[int, dict]:
+        """Fetches up to MAX_PER_PAGE * MAX_ALIASES medias in a single request"""
+        chunks = [ids[i:i + MAX_PER_PAGE] for i in range(0, len(ids), MAX_PER_PAGE)]
+        json_query = build_media_batch_query(len(chunks), fragments)
+        variables = {f"ids{i}": chunk for i, chunk in enumerate(chunks)}
+        response = await self.make_request(json_query, variables,
+                                           ttl=MEDIA_SEARCH_TTL, priority=priority)
+
+        medias = {}
+        for page in response["data"].values():
+            for media in page["media"]:
+                medias[media["id"]] = media
+        return medias
+
+    async def fetch_media(self,
+                          ids: Iterable[int], *,
+                          fragments: Optional[Tuple[utils.Fragment, ...]] = None,
+                          priority: core.Priority = core.Priority.INTERACTIVE) -> Dict[int, dict]:
+        """
+        Fetches medias by id, concurrent calls asking for the same fragments
+        within a small window share their requests, ids that weren't found are left out
+        """
+        fragments = fragments or self.front_fragments
+        if (loader := self.media_loaders.get((fragments, priority))) is None:
+            batch_func = functools.partial(self._load_media_batch, fragments, priority)
+            loader = utils.BatchLoader(batch_func,
+                                       window=BATCH_WINDOW,
+                                       max_batch_size=MAX_PER_PAGE * MAX_ALIASES)
+            self.media_loaders[fragments, priority] = loader
+
+        ids = [*dict.fromkeys(ids)]
+        medias = await loader.load_many(ids)
+        return {id_: media for id_, media in zip(ids, medias) if media is not None}
+
+    async def fetch_fields(self, results: List[core.Media], fragment: utils.Fragment):
+        """Fetches extra fields for some medias, then adds them in place"""
+        ids = [media.id for media in results]
+        details = await self.fetch_media(ids, fragments=(fragment,))
+
+        for media in results:
+            if data := details.get(media.id):
+                media.update(data)
+
+    def start_menu(self, ctx: core.Context, results: List[dict]):
+        """Starts a menu, the raw results are parsed once and dropped"""
+        results = [*map(core.Media, results)]
+        main_source, *extra_sources = [Source(results) for Source in self.sources]
+        menu = MediaPages(main_source=main_source,
+                          extra_sources=extra_sources,
+                          fields_loader=self.fetch_fields)
+        return menu.start(ctx, wait=True)
+
+    # Schedule ingestion
+
+    async def fetch_schedule_pages(self, start: int, end: int) -> Tuple[List[dict], bool]:
+        """Pages through the airing schedules between two timestamps, returns whether it got all of them"""
+        schedules = []
+        json_query = SCHEDULE_INGEST.build(fragments=self.front_fragments)
+
+        for page in range(1, INGEST_MAX_PAGES + 1):
+            variables = {
+                "page": page,
+                "perPage": MAX_PER_PAGE,
+                "airingSort": "TIME",
+                "airingAfter": start,
+                "airingBefore": end,
+            }
+            response = await self.make_request(json_query, variables,
+                                               priority=core.Priority.BACKGROUND,
+                                               use_cache=False)
+            data = response["data"]["Page"]
+            schedules.extend(data["airingSchedules"])
+
+            if not data["pageInfo"]["hasNextPage"]:
+                return schedules, True
+
+        return schedules, False
+
+    @tasks.loop(minutes=INGEST_INTERVAL)
+    async def ingest_schedule(self):
+        """Mirrors the next days' airing schedule into postgres"""
+        if not self.bot.pool:
+            return
+
+        now = dt.datetime.now(dt.timezone.utc)
+        end = now + dt.timedelta(days=INGEST_DAYS)
+        schedules, complete = await self.fetch_schedule_pages(int(now.timestamp()), int(end.timestamp()))
+
+        records = [
+            (
+                schedule["id"],
+                schedule["media"]["id"],
+                schedule["episode"],
+                dt.datetime.fromtimestamp(schedule["airingAt"], tz=dt.timezone.utc),
+                bool(schedule["media"]["isAdult"]),  # null for some medias
+                json.dumps(schedule["media"], separators=(',', ':')),
+                now,
+            )
+            for schedule in schedules if schedule["media"]
+        ]
+
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(UPSERT_SCHEDULE, records)
+                # Past the page cap, rows that weren't seen might just be on the next pages,
+                # only what already aired goes then
+                prune_until = end if complete else now
+                await conn.execute(PRUNE_SCHEDULE, now, prune_until, now)
+
+        self.bot.logger.info("Ingested %s airing schedules", len(records))
+
+    @ingest_schedule.before_loop
+    async def before_ingest_schedule(self):
+        await self.bot.wait_until_ready()
+
+    @ingest_schedule.error
+    async def on_ingest_schedule_error(self, error: Exception):
+        self.bot.dispatch("error", "Schedule ingestion", exception=error)
 
-    async def make_request(self, query: str, variables: dict):
-        json_ = {'query': query, 'variables': variables}
-        async with self.bot.session.post(self.url, json=json_) as r:
-            resp = await r.json()
+    async def local_schedule(self, *, nsfw: bool, limit: int = 10) -> List[dict]:
+        """The upcoming medias from the local mirror, empty if it's unavailable"""
+        if not self.bot.pool:
+            return []
 
-            if r.status == 200:
-                return resp
+        now = dt.datetime.now(dt.timezone.utc)
+        try:
+            rows = await self.bot.pool.fetch(LOCAL_SCHEDULE, now, nsfw, limit)
+        except core.StorageUnavailable:
+            return []
+        except Exception as e:
+            self.bot.dispatch("error", "Local schedule", exception=e)
+            return []
 
-        errors = [f"{err['status']}: {err['message']}" for err in resp["errors"]]
-        formatted_errors = '\n'.join(errors)
-        raise commands.BadArgument(formatted_errors)
+        return [json.loads(row["media"]) for row in rows]
+
+    # Catalog
+
+    @staticmethod
+    def to_catalog_record(media: dict) -> tuple:
+        titles = [*media["title"].values(), *(media.get("synonyms") or [])]
+        return (
+            media["id"],
+            bool(media["isAdult"]),  # null for some medias
+            media.get("popularity") or 0,
+            ' / '.join(filter(None, titles)),
+            json.dumps(media, separators=(',', ':')),
+        )
+
+    async def store_catalog(self, medias: List[dict]):
+        """Upserts medias in the catalog"""
+        records = [*map(self.to_catalog_record, medias)]
+        try:
+            await self.bot.pool.executemany(UPSERT_CATALOG, records)
+        except core.StorageUnavailable:
+            pass  # the catalog is only a cache, anilist still has them
+        except Exception as e:
+            self.bot.dispatch("error", "Catalog storage", exception=e)
+
+    @tasks.loop(hours=CATALOG_CHECK_INTERVAL)
+    async def ingest_catalog(self):
+        """Pages through the most popular medias, storing them as they come, restarts don't redo it"""
+        if not self.bot.pool:
+            return
+
+        last_ingestion = await self.bot.pool.fetchval(LAST_INGESTION, "catalog")
+        if last_ingestion is not None and dt.datetime.now(dt.timezone.utc) - last_ingestion < CATALOG_INTERVAL:
+            return
+
+        json_query = MEDIA_SEARCH.build_for({"sort": None}, self.catalog_fragments)
+        stored = 0
+
+        for page in range(1, CATALOG_MAX_PAGES + 1):
+            variables = {"page": page, "perPage": MAX_PER_PAGE, "sort": "POPULARITY_DESC"}
+            response = await self.make_request(json_query, variables,
+                                               priority=core.Priority.BACKGROUND,
+                                               use_cache=False)
+            medias = response["data"]["Page"]["media"]
+            await self.store_catalog(medias)
+            stored += len(medias)
+
+            if len(medias) < MAX_PER_PAGE:
+                break
+
+        await self.bot.pool.execute(RECORD_INGESTION, "catalog")
+        self.bot.logger.info("Ingested %s medias in the catalog", stored)
+
+    @ingest_catalog.before_loop
+    async def before_ingest_catalog(self):
+        await self.bot.wait_until_ready()
+
+    @ingest_catalog.error
+    async def on_ingest_catalog_error(self, error: Exception):
+        self.bot.dispatch("error", "Catalog ingestion", exception=error)
+
+    async def local_search(self, query: str, *, nsfw: bool, limit: int = 10) -> List[dict]:
+        """
+        Resolves a title against the catalog, stale entries get refreshed from anilist
+        but we keep what we have if it's too slow, minus the time sensitive fields,
+        empty unless the best match is close enough to be the media that was asked for
+        """
+        if not self.bot.pool:
+            return []
+
+        try:
+            rows = await self.bot.pool.fetch(LOCAL_SEARCH, query, nsfw, limit)
+        except core.StorageUnavailable:
+            return []
+        except Exception as e:
+            self.bot.dispatch("error", "Local search", exception=e)
+            return []
+
+        if not rows or rows[0]["score"] < LOCAL_MATCH_THRESHOLD:
+            return []
+
+        results = {row["id"]: json.loads(row["media"]) for row in rows}
+        stale_before = dt.datetime.now(dt.timezone.utc) - CATALOG_FRESHNESS
+        stale_ids = [row["id"] for row in rows if row["updated_at"] < stale_before]
+
+        if stale_ids:
+            try:
+                fresh = await asyncio.wait_for(
+                    self.fetch_media(stale_ids, fragments=self.catalog_fragments),
+                    timeout=HYDRATE_TIMEOUT
+                )
+            except (asyncio.TimeoutError, core.AnilistError):
+                for id_ in stale_ids:
+                    results[id_].update(dict.fromkeys(TIME_SENSITIVE_FIELDS))
+            else:
+                results.update(fresh)
+                self.bot.loop.create_task(self.store_catalog([*fresh.values()]))
+
+        return [*results.values()]
 
     async def cog_before_invoke(self, ctx: core.Context):
         bucket = self.cooldown.get_bucket(ctx.message)
@@ -627,54 +1023,55 @@ class Anilist(commands.Cog):
     @commands.command()
     async def search(self, ctx: core.Context, *, query: str):
         """Looks for infos about an anime or a manga"""
-        params = ["$search: String", "$sort: [MediaSort]",]
+        if results := await self.local_search(query, nsfw=ctx.is_nsfw):
+            return await self.start_menu(ctx, results)
+
         variables = self.default_variables.copy()
         extra_variables = {
             "search": query,
             "sort": "POPULARITY_DESC",
-            "characterSort": "FAVOURITES_DESC"
         }
         variables.update(extra_variables)
 
         if not ctx.is_nsfw:
-            params.append("$isAdult: Boolean")
             variables['isAdult'] = False
 
-        params = utils.to_graphql_search_param(*params)
-        json_query = MEDIA_SEARCH % params
+        json_query = MEDIA_SEARCH.build_for(variables, self.catalog_fragments)
 
-        response = await self.make_request(json_query, variables)
+        response = await self.make_request(json_query, variables, ttl=MEDIA_SEARCH_TTL)
         if not (results := response['data']['Page']['media']):
             raise NoResultsError(query)
 
-        main_source, *extra_sources = [Source(results) for Source in self.sources]
-        menu = MediaPages(main_source=main_source, extra_sources=extra_sources)
-        await menu.start(ctx, wait=True)
+        if self.bot.pool:
+            self.bot.loop.create_task(self.store_catalog(results))
+
+        await self.start_menu(ctx, results)
 
     @commands.command()
     async def schedule(self, ctx: core.Context):
         """Gives the schedule for upcoming medias"""
-        params = ["$airingSort: [AiringSort]"]
+        if results := await self.local_schedule(nsfw=ctx.is_nsfw):
+            return await self.start_menu(ctx, results)
+
+        # The mirror is empty or unreachable, asking anilist directly
         variables = self.default_variables.copy()
 
         float_timestamp =  dt.datetime.now(tz=dt.timezone.utc).timestamp()
-        curr_timestamp = int(float_timestamp)
+        # Rounded down so that everyone in the same window shares a cache entry
+        curr_timestamp = int(float_timestamp) // SCHEDULE_TTL * SCHEDULE_TTL
         extra_variables = {
             "airingSort": "TIME",
             "airingAfter": curr_timestamp
         }
         variables.update(extra_variables)
-        params = utils.to_graphql_search_param(*params)
-        response = await self.make_request(SCHEDULE_SEARCH, variables)
+        json_query = SCHEDULE_SEARCH.build(fragments=self.front_fragments)
+        response = await self.make_request(json_query, variables, ttl=SCHEDULE_TTL)
         if not (nested_results := response["data"]["Page"]["airingSchedules"]):
             raise NoScheduleError()
 
         unfiltered_results = [res["media"] for res in nested_results]
         results = [res for res in unfiltered_results if not res["isAdult"] or ctx.is_nsfw]
-        main_source, *extra_sources = [Source(results) for Source in self.sources]
-
-        menu = MediaPages(main_source=main_source, extra_sources=extra_sources)
-        await menu.start(ctx, wait=True)
+        await self.start_menu(ctx, results)
 
 
 
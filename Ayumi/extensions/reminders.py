@@ -0,0 +1,349 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import heapq
+import asyncio
+import collections
+import datetime as dt
+from typing import List, NamedTuple, Callable, Awaitable, Dict, Iterable, Generator
+
+import discord
+from discord.ext import commands
+
+import core
+
+# Only the reminders due within the window are kept in memory,
+# the next window gets loaded a bit before the current one ends
+
+LOAD_WINDOW = dt.timedelta(hours=1)
+REFILL_MARGIN = dt.timedelta(minutes=5)
+MAX_LOADED = 50_000
+STORAGE_RETRY = 10  # seconds, how often we look if the database is back
+
+# Keyset pagination, reminders sharing a timestamp can be split between two loads
+LOAD_REMINDERS = """
+SELECT trigger_time, id, user_id, anime_name, channel_id
+FROM anime_reminders
+WHERE (trigger_time, id) > ($1, $2) AND trigger_time < $3
+ORDER BY trigger_time, id
+LIMIT $4
+"""
+
+INSERT_REMINDER = """
+INSERT INTO anime_reminders (user_id, trigger_time, anime_name, channel_id)
+VALUES ($1, $2, $3, $4)
+RETURNING trigger_time, id, user_id, anime_name, channel_id
+"""
+
+DELETE_USER_REMINDER = """
+DELETE FROM anime_reminders
+WHERE user_id = $1 AND anime_name = $2 AND trigger_time = $3
+RETURNING id
+"""
+
+DELETE_REMINDERS = "DELETE FROM anime_reminders WHERE id = ANY($1::bigint[])"
+
+# Delivery, a single message pings everyone waiting for the same media in a channel
+
+AIRING_TEMPLATE = "**{0}** is airing now !\n"
+MAX_MESSAGE_LENGTH = 2000
+MAX_MENTIONS = 50
+REMINDER_MENTIONS = discord.AllowedMentions(everyone=False, roles=False, users=True)
+
+
+def utcnow() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc)
+
+
+class Reminder(NamedTuple):
+    """trigger_time comes first so that reminders can be pushed as is in a heap"""
+    trigger_time: dt.datetime
+    id: int
+    user_id: int
+    anime_name: str
+    channel_id: int
+
+
+class ReminderScheduler:
+    """
+    Keeps the reminders due in the next window in a min heap,
+    then sleeps until the earliest one instead of polling the table
+
+    Everything up to the (loaded_until, loaded_id) cursor is in the heap,
+    everything after it is only in the database, the heap never holds more
+    than MAX_LOADED reminders, the rest gets loaded as they're delivered
+    """
+    def __init__(self,
+                 bot: core.Bot,
+                 callback: Callable[[List[Reminder]], Awaitable], *,
+                 window: dt.timedelta = LOAD_WINDOW):
+        self.bot = bot
+        self.callback = callback
+        self.window = window
+        self.heap: List[Reminder] = []
+        self.scheduled_ids = set()
+        self.cancelled = set()
+        self.removed = set()  # deleted while a load was running, the load might have fetched them
+        self.loaded_until = self.loading_until = dt.datetime.min.replace(tzinfo=dt.timezone.utc)
+        self.loaded_id = 0
+        self._loading = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self.heap) - len(self.cancelled)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # Loading
+
+    async def load_window(self, now: dt.datetime):
+        """Loads the reminders after the cursor up to now + window, as many as the heap has room for"""
+        target = self.loading_until = now + self.window
+        limit = MAX_LOADED - len(self.heap)
+        self.removed.clear()
+        self._loading = True
+        try:
+            rows = await self.bot.pool.fetch(LOAD_REMINDERS, self.loaded_until, self.loaded_id, target, limit)
+        finally:
+            self._loading = False
+
+        for row in rows:
+            if row["id"] not in self.removed:
+                self._push(Reminder(*row))
+        self.removed.clear()
+
+        if len(rows) < limit:
+            new_until, new_id = target, 0  # ids start at 1, so that's everything before target
+        else:
+            # Too many to hold at once, the rest comes once some got delivered
+            new_until, new_id = rows[-1]["trigger_time"], rows[-1]["id"]
+
+        self.loaded_until = self.loading_until = new_until
+        self.loaded_id = new_id
+
+    def _push(self, reminder: Reminder) -> bool:
+        """Pushes a reminder unless it's already there"""
+        if reminder.id in self.scheduled_ids:
+            return False
+        self.scheduled_ids.add(reminder.id)
+        heapq.heappush(self.heap, reminder)
+        return True
+
+    # Public api
+
+    def schedule(self, reminder: Reminder):
+        """Adds a reminder that was just inserted, if it's within the window"""
+        # A window being loaded might have missed it, duplicates are ignored
+        loaded = max((self.loaded_until, self.loaded_id), (self.loading_until, 0))
+        if (reminder.trigger_time, reminder.id) > loaded:
+            return  # will be loaded with its window
+
+        if self._push(reminder) and self.heap[0] is reminder:
+            self._wakeup.set()
+
+    def cancel(self, reminder_id: int):
+        """Lazily removes a reminder, it gets skipped once it's popped"""
+        if reminder_id in self.scheduled_ids:
+            self.cancelled.add(reminder_id)
+        elif self._loading:
+            self.removed.add(reminder_id)
+
+    async def add(self, *, user_id: int, trigger_time: dt.datetime, anime_name: str,
+                  channel_id: int) -> Reminder:
+        row = await self.bot.pool.fetchrow(INSERT_REMINDER, user_id, trigger_time,
+                                           anime_name, channel_id)
+        reminder = Reminder(*row)
+        self.schedule(reminder)
+        return reminder
+
+    def _schedule_row(self, row):
+        self.schedule(Reminder(*row))
+
+    async def toggle(self, *, user_id: int, trigger_time: dt.datetime, anime_name: str,
+                     channel_id: int) -> bool:
+        """
+        Adds the reminder if it doesn't exist, removes it otherwise, returns if it was added,
+        while the database is down we can't know if it exists, so it's always added once it's back
+        """
+        if not self.bot.pool:
+            await self.bot.pool.buffer("fetchrow", INSERT_REMINDER, user_id, trigger_time,
+                                       anime_name, channel_id, callback=self._schedule_row,
+                                       key=("reminder", user_id, anime_name, trigger_time))
+            return True
+
+        deleted = await self.bot.pool.fetch(DELETE_USER_REMINDER, user_id, anime_name, trigger_time)
+
+        if deleted:
+            for row in deleted:
+                self.cancel(row["id"])
+            return False
+
+        await self.add(user_id=user_id, trigger_time=trigger_time,
+                       anime_name=anime_name, channel_id=channel_id)
+        return True
+
+    # Main loop
+
+    def pop_due(self, now: dt.datetime) -> List[Reminder]:
+        """Pops every reminder that should have fired by now"""
+        due = []
+        while self.heap and self.heap[0].trigger_time <= now:
+            reminder = heapq.heappop(self.heap)
+            self.scheduled_ids.discard(reminder.id)
+            if reminder.id in self.cancelled:
+                self.cancelled.discard(reminder.id)
+            else:
+                due.append(reminder)
+        return due
+
+    async def sleep_until(self, deadline: dt.datetime):
+        """Sleeps until the deadline, or until something earlier gets scheduled"""
+        delay = (deadline - utcnow()).total_seconds()
+        if delay <= 0:
+            return
+
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def delete(self, reminders: List[Reminder]):
+        """Buffered during an outage, a restart before it ends would send them again"""
+        try:
+            await self.bot.pool.buffer("execute", DELETE_REMINDERS, [reminder.id for reminder in reminders])
+        except Exception as e:
+            self.bot.dispatch("error", "Reminder deletion", exception=e)
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while not self.bot.is_closed():
+            now = utcnow()
+
+            if now + REFILL_MARGIN >= self.loaded_until and len(self.heap) < MAX_LOADED:
+                try:
+                    await self.load_window(now)
+                except core.StorageUnavailable:
+                    await asyncio.sleep(STORAGE_RETRY)
+                    continue
+                except Exception as e:
+                    self.bot.dispatch("error", "Reminder loading", exception=e)
+                    await asyncio.sleep(REFILL_MARGIN.total_seconds())
+                    continue
+
+            if due := self.pop_due(now):
+                try:
+                    await self.callback(due)
+                except Exception as e:
+                    self.bot.dispatch("error", "Reminder delivery", exception=e)
+
+                # Not retried even if the callback failed, it would most likely fail again
+                await self.delete(due)
+                continue
+
+            if len(self.heap) >= MAX_LOADED:
+                deadline = self.heap[0].trigger_time  # there's room once the first one is delivered
+            else:
+                deadline = self.loaded_until - REFILL_MARGIN
+                if self.heap:
+                    deadline = min(deadline, self.heap[0].trigger_time)
+
+            await self.sleep_until(deadline)
+
+
+def group_reminders(reminders: Iterable[Reminder]) -> Dict[int, Dict[str, List[int]]]:
+    """Groups user ids by channel, then by media, duplicates are removed"""
+    grouped = collections.defaultdict(lambda: collections.defaultdict(dict))
+    for reminder in reminders:
+        grouped[reminder.channel_id][reminder.anime_name][reminder.user_id] = None
+    return {
+        channel_id: {name: [*user_ids] for name, user_ids in medias.items()}
+        for channel_id, medias in grouped.items()
+    }
+
+
+def format_reminder_messages(anime_name: str,
+                             user_ids: List[int], *,
+                             max_mentions: int = MAX_MENTIONS,
+                             max_length: int = MAX_MESSAGE_LENGTH) -> Generator[str, None, None]:
+    """Splits the mentions in as few messages as the limits allow"""
+    header = AIRING_TEMPLATE.format(anime_name)
+    mentions = []
+    length = len(header)
+
+    for user_id in user_ids:
+        mention = f"<@{user_id}> "
+        if len(mentions) >= max_mentions or length + len(mention) > max_length:
+            yield header + ''.join(mentions)
+            mentions = []
+            length = len(header)
+
+        mentions.append(mention)
+        length += len(mention)
+
+    if mentions:
+        yield header + ''.join(mentions)
+
+
+class Reminders(commands.Cog):
+    def __init__(self, bot: core.Bot):
+        self.bot = bot
+        self.scheduler = ReminderScheduler(bot, self.deliver)
+        self.scheduler.start()  # waits for the database by itself if it's down
+
+        self.delivered = 0
+        self.messages_sent = 0
+
+    def cog_unload(self):
+        self.scheduler.stop()
+
+    async def send_to_channel(self, channel_id: int, medias: Dict[str, List[int]]):
+        """Messages in a channel are sent one after another, to respect its rate limit"""
+        if not (channel := self.bot.get_channel(channel_id)):
+            return
+
+        for anime_name, user_ids in medias.items():
+            for content in format_reminder_messages(anime_name, user_ids):
+                try:
+                    await channel.send(content, allowed_mentions=REMINDER_MENTIONS)
+                except discord.Forbidden:
+                    return
+                except discord.HTTPException:
+                    continue
+                else:
+                    self.messages_sent += 1
+
+    async def deliver(self, reminders: List[Reminder]):
+        """Sends the reminders grouped by channel, channels are handled concurrently"""
+        grouped = group_reminders(reminders)
+        coros = [self.send_to_channel(channel_id, medias) for channel_id, medias in grouped.items()]
+        for result in await asyncio.gather(*coros, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.bot.dispatch("error", "Reminder delivery", exception=result)
+
+        self.delivered += len(reminders)
+
+
+def setup(bot: core.Bot):
+    cog = Reminders(bot)
+    bot.add_cog(cog)
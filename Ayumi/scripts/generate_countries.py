@@ -0,0 +1,68 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Generates core/countries.py from pycountry, which the bot doesn't need at runtime anymore,
+only rerun it if the ISO 3166 names need updating (pip install pycountry first)
+
+Usage (from the Ayumi folder): python -m scripts.generate_countries
+"""
+import pathlib
+from importlib import metadata
+
+import pycountry
+
+OUTPUT = pathlib.Path(__file__).parent.parent / "core" / "countries.py"
+
+HEADER = '''"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Generated by scripts/generate_countries.py from pycountry {version}, don't edit it by hand
+"""
+
+import types
+
+# ISO 3166-1 alpha-2 code -> official name, or the usual one if there's no official name
+COUNTRY_NAMES = types.MappingProxyType({{
+{entries}
+}})
+'''
+
+
+def main():
+    names = {
+        country.alpha_2: getattr(country, "official_name", country.name)
+        for country in pycountry.countries
+    }
+    entries = '\n'.join(f"    {code!r}: {name!r}," for code, name in sorted(names.items()))
+
+    OUTPUT.write_text(HEADER.format(version=metadata.version("pycountry"), entries=entries), encoding="utf-8")
+    print(f"Wrote {len(names)} countries to {OUTPUT}")
+
+
+if __name__ == '__main__':
+    main()
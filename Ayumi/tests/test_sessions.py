@@ -0,0 +1,103 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Usage (from the Ayumi folder): python -m unittest discover tests
+"""
+import types
+import asyncio
+import unittest
+
+import discord
+from discord.ext import menus
+
+import core
+
+STOP = '\N{BLACK SQUARE FOR STOP}\ufe0f'
+AUTHOR_ID = 42
+
+
+class FakeMessage:
+    id = 1
+
+    def __init__(self):
+        self.deleted = False
+
+    async def delete(self):
+        await asyncio.sleep(0)  # a request, where a pending cancellation would land
+        self.deleted = True
+
+
+class FakeBot:
+    owner_id = None
+    owner_ids = set()
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.menus = core.MenuRegistry(self)
+        self.errors = []
+
+    def is_closed(self) -> bool:
+        return False
+
+    def dispatch(self, event: str, *args, **kwargs):
+        self.errors.append((args, kwargs))
+
+
+class StopMenu(core.RegisteredMenu, menus.Menu):
+    @menus.button(STOP)
+    async def on_stop(self, payload):
+        self.stop()
+
+
+class TestRegisteredMenu(unittest.IsolatedAsyncioTestCase):
+    async def start_menu(self) -> StopMenu:
+        menu = StopMenu(delete_message_after=True)
+        menu.bot = FakeBot(asyncio.get_running_loop())
+        menu.message = FakeMessage()
+        menu._author_id = AUTHOR_ID
+        menu._running = True
+        self.task = menu.bot.loop.create_task(menu._internal_loop())
+        menu._Menu__tasks.append(self.task)  # what menu.start does, so that stop cancels it
+        await asyncio.sleep(0)
+        return menu
+
+    def react(self, menu: StopMenu, emoji: str):
+        payload = types.SimpleNamespace(
+            message_id=menu.message.id, user_id=AUTHOR_ID, emoji=discord.PartialEmoji(name=emoji)
+        )
+        menu.bot.menus.dispatch(payload)
+
+    async def test_stop_deletes_the_message(self):
+        menu = await self.start_menu()
+        self.react(menu, STOP)
+        await asyncio.wait([self.task], timeout=1)
+
+        self.assertTrue(self.task.done())
+        self.assertTrue(menu.message.deleted)
+        self.assertEqual(len(menu.bot.menus), 0)
+        self.assertEqual(menu.bot.errors, [])
+
+    async def test_unrelated_reactions_are_ignored(self):
+        menu = await self.start_menu()
+        self.react(menu, '\N{THUMBS UP SIGN}')
+        await asyncio.sleep(0)
+
+        self.assertEqual(menu.bot.menus.sessions[menu.message.id].queue.qsize(), 0)
+        menu.stop()
+        await asyncio.wait([self.task], timeout=1)
+        self.assertTrue(menu.message.deleted)
+
+
+if __name__ == '__main__':
+    unittest.main()
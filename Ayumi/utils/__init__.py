@@ -22,3 +22,7 @@ from .tracebacks import *
 from .formatters import *
 from .confirm import *
 from .constants import *
+from .cache import *
+from .concurrency import *
+from .graphql import *
+from .fuzzy import *
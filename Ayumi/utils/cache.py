@@ -0,0 +1,177 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+import time
+import zlib
+import hashlib
+import collections
+from typing import Any, Optional, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Collapses all whitespace so that differently indented queries share a key"""
+    return ' '.join(query.split())
+
+
+def make_cache_key(query: str, variables: dict) -> str:
+    """Builds a stable key out of a graphql query and its variables"""
+    dumped_variables = json.dumps(variables, sort_keys=True, separators=(',', ':'))
+    raw_key = f"{normalize_query(query)}|{dumped_variables}"
+    return hashlib.sha1(raw_key.encode()).hexdigest()
+
+
+class TTLCache:
+    """
+    A LRU cache where every entry expires after its own ttl,
+    bounded by the total size (in bytes) of what it holds
+    """
+    def __init__(self, *, max_size: int = 16 * 1024 * 1024, default_ttl: float = 300):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key: (expires_at, size, value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not None
+
+    def _pop(self, key: str) -> Tuple[float, int, Any]:
+        """Removes an entry and keeps track of the size"""
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+        return entry
+
+    def get(self, key: str, *, count: bool = True) -> Optional[Any]:
+        """Returns the value if it's still fresh, None otherwise"""
+        try:
+            expires_at, _, value = self._entries[key]
+        except KeyError:
+            self.misses += count
+            return None
+
+        if expires_at < time.monotonic():
+            self._pop(key)
+            self.misses += count
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += count
+        return value
+
+    def set(self, key: str, value: Any, *, size: int = 1, ttl: Optional[float] = None):
+        """Stores a value, evicting the least recently used ones if we're too big"""
+        if size > self.max_size:
+            return
+
+        if key in self._entries:
+            self._pop(key)
+
+        ttl = self.default_ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.size += size
+
+        while self.size > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._pop(oldest_key)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return ("<TTLCache entries={0} size={1.size}/{1.max_size} "
+                "hits={1.hits} misses={1.misses}>").format(len(self), self)
+
+
+class TieredCache:
+    """
+    A local TTLCache backed by redis, so that every process
+    (and the next restart) can reuse what another one fetched
+    """
+    def __init__(self, local: TTLCache, redis=None, *, prefix: str = "ayumi:cache:"):
+        self.local = local
+        self.redis = redis or None  # fallbacks are falsy, we don't want them to log every call
+        self.prefix = prefix
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    @staticmethod
+    def dump(value: Any) -> bytes:
+        """Compact payload stored in redis"""
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Looks in memory first, then in redis"""
+        if (value := self.local.get(key)) is not None:
+            return value
+
+        if self.redis is None:
+            return None
+
+        # A single round trip, and the key can't expire between the two commands
+        transaction = self.redis.multi_exec()
+        transaction.get(self.prefix + key)
+        transaction.ttl(self.prefix + key)
+        try:
+            payload, ttl = await transaction.execute()
+        except Exception:
+            self.redis_errors += 1
+            return None
+
+        if not payload:
+            return None
+
+        try:
+            raw = zlib.decompress(payload)
+            value = json.loads(raw)
+        except (zlib.error, ValueError):
+            self.redis_errors += 1  # corrupted, or not written by us, same as a miss
+            return None
+
+        self.redis_hits += 1
+        self.local.set(key, value, size=len(raw), ttl=max(ttl, 1))
+        return value
+
+    async def set(self, key: str, value: Any, *,
+                  size: int = 1,
+                  ttl: Optional[float] = None,
+                  payload: Optional[bytes] = None):
+        """
+        Stores the value in both tiers,
+        payload can be given if the raw json is already available
+        """
+        self.local.set(key, value, size=size, ttl=ttl)
+
+        if self.redis is None:
+            return
+
+        ttl = self.local.default_ttl if ttl is None else ttl
+        compressed = zlib.compress(payload) if payload is not None else self.dump(value)
+
+        try:
+            await self.redis.set(self.prefix + key, compressed, expire=max(int(ttl), 1))
+        except Exception:
+            self.redis_errors += 1
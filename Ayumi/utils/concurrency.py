@@ -0,0 +1,149 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class SingleFlight:
+    """
+    Merges concurrent calls that share the same key,
+    every waiter gets the result (or the exception) of the first one
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.merged = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """Runs func(*args, **kwargs) unless an identical call is already running"""
+        if (future := self._calls.get(key)) is not None:
+            self.merged += 1
+        else:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # A waiter getting cancelled shouldn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+
+class TokenBucket:
+    """
+    A classic token bucket, `rate` tokens are refilled every `per` seconds
+    """
+    def __init__(self, rate: int, per: float):
+        self.capacity = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated_at = time.monotonic()
+
+    @property
+    def fill_rate(self) -> float:
+        return self.capacity / self.per
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate)
+        self.updated_at = now
+
+    def consume(self) -> float:
+        """Takes a token, returns how long to wait for one instead if there are none left"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.fill_rate
+
+    async def acquire(self):
+        """Waits until a token can be taken"""
+        while delay := self.consume():
+            await asyncio.sleep(delay)
+
+    def update(self, *, limit: Optional[int] = None, remaining: Optional[int] = None):
+        """Syncs the bucket with what the server told us"""
+        self._refill()
+        if limit is not None and limit != self.capacity:
+            self.capacity = limit
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class BatchLoader:
+    """
+    Collects the keys that are asked for within a small window
+    and loads them with a single call, the dataloader pattern
+
+    batch_func takes a list of keys and returns a dict of the ones it found,
+    missing keys resolve to None
+    """
+    def __init__(self,
+                 batch_func: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]], *,
+                 window: float = 0.01,
+                 max_batch_size: int = 50):
+        self.batch_func = batch_func
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    async def load(self, key: Hashable) -> Any:
+        """Loads a single key, batched with everyone else's"""
+        loop = asyncio.get_event_loop()
+
+        if (future := self._pending.get(key)) is None:
+            future = self._pending[key] = loop.create_future()
+
+            if len(self._pending) >= self.max_batch_size:
+                self._dispatch()
+            elif self._handle is None:
+                self._handle = loop.call_later(self.window, self._dispatch)
+
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        return await asyncio.gather(*map(self.load, keys))
+
+    def _dispatch(self):
+        """Sends everything that was collected so far"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        batch, self._pending = self._pending, {}
+        if batch:
+            self.batches += 1
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self.batch_func([*batch])
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            # Only left undone if we got cancelled, the awaiters would hang otherwise
+            for future in batch.values():
+                if not future.done():
+                    future.cancel()
@@ -16,26 +16,29 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import operator
-import difflib
-from typing import List, Tuple, Callable, Optional
+import functools
+import collections
+from typing import Callable, Optional
 
 from discord.ext import commands
 
-import core
+MATCH_THRESHOLD = .75
 
 
 class Literal:
     """
-    A converter that tries to match a literal set of values
+    A converter that tries to match a literal set of values,
+    converters are cached so subscripting with the same values is free
     """
     @staticmethod
-    def get_ratio(left: str, right: str) -> Tuple[float, str]:
-        """Avoids having to stick everything in a single line"""
-        return difflib.SequenceMatcher(None, left, right).quick_ratio(), left
+    @functools.lru_cache(maxsize=128)
+    def make_converter(values: tuple) -> Callable[[str], Optional[str]]:
+        """Everything that only depends on the values is computed once here"""
+        values_set = frozenset(values)
+
+        # The same computation as SequenceMatcher.quick_ratio, without building a matcher
+        profiles = [(value, len(value), dict(collections.Counter(value)).get) for value in values]
 
-    def __class_getitem__(cls, values: tuple) -> Callable[[str], Optional[str]]:
-        """The converter factory"""
         def actual_converter(arg: str) -> Optional[str]:
             """The converter that we return"""
 
@@ -43,7 +46,7 @@ class Literal:
 
             # We got a full match
 
-            if arg in values:
+            if arg in values_set:
                 return arg
 
             # Using it's index (would make sense for months)
@@ -53,12 +56,26 @@ class Literal:
             except (IndexError, ValueError):
                 pass
 
-            # Difflib
+            # Character profiles, the first best match wins like max() would
+
+            arg_length = len(arg)
+            arg_chars, arg_counts = zip(*collections.Counter(arg).items()) if arg else ((), ())
+            zeros = (0,) * len(arg_chars)
+            best_ratio, best_match = 0, None
+
+            for value, length, get_count in profiles:
+                total = arg_length + length
 
-            matches = [cls.get_ratio(compared, arg) for compared in values]
-            default = 0, 0
-            best_ratio, best_match, = max(matches, key=operator.itemgetter(0), default=default)
-            if best_ratio > .75:
+                # Even if every character matched, it couldn't beat what we have
+                if total and 2.0 * min(arg_length, length) / total <= max(best_ratio, MATCH_THRESHOLD):
+                    continue
+
+                matches = sum(map(min, arg_counts, map(get_count, arg_chars, zeros)))
+                ratio = 2.0 * matches / total if total else 1.0
+                if ratio > best_ratio:
+                    best_ratio, best_match = ratio, value
+
+            if best_ratio > MATCH_THRESHOLD:
                 return best_match
 
             # No match
@@ -69,4 +86,6 @@ class Literal:
 
         return actual_converter
 
-
+    def __class_getitem__(cls, values: tuple) -> Callable[[str], Optional[str]]:
+        """The converter factory"""
+        return cls.make_converter(tuple(values))
@@ -23,7 +23,6 @@ import re
 
 import discord
 from discord.ext import commands
-from jishaku import codeblocks
 
 from typing import Optional, Tuple, Callable, Union
 
@@ -132,8 +131,11 @@ class LongEmbed(Embed):
     """Long embed used for text that stretches vertically"""
     def remove_codeblocks(self, page: str):
         """Removes the prefix and suffix to replace them properly"""
-        _, content = codeblocks.codeblock_converter(page)
-        return content.strip()
+        if self.prefix and page.startswith(self.prefix):
+            page = page[len(self.prefix):]
+        if self.suffix and page.endswith(self.suffix):
+            page = page[:-len(self.suffix)]
+        return page.strip()
 
     def __init__(self, **options):
         super().__init__(**options)
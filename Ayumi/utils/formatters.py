@@ -75,16 +75,3 @@ def camelcase_to_natural(arg: str) -> str:
     """camelCase -> camel case"""
     mapped = map(split_by_caps, arg)
     return ''.join(mapped)
-
-def to_graphql_search_param(*data: str):
-    """Makes it easier to format graphql search data"""
-    media_params = []
-
-    for param in data:
-        arg_pointer, _ = param.split(':')
-
-        arg_name = arg_pointer[1:]
-        media_params.append(f"{arg_name}: {arg_pointer}")
-
-    return ', '.join(data), ', '.join(media_params)
-
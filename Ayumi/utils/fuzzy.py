@@ -0,0 +1,113 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def levenshtein(left: str, right: str, max_distance: Optional[int] = None) -> int:
+    """
+    The edit distance between two strings, if it goes over max_distance
+    the computation stops early and max_distance + 1 is returned
+    """
+    if len(left) < len(right):
+        left, right = right, left
+
+    if max_distance is None:
+        max_distance = len(left)
+
+    if len(left) - len(right) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(right) + 1))
+
+    for i, left_char in enumerate(left, 1):
+        current = [i]
+        last = i
+        for j, right_char in enumerate(right):
+            last = min(previous[j + 1] + 1, last + 1, previous[j] + (left_char != right_char))
+            current.append(last)
+
+        if min(current) > max_distance:
+            return max_distance + 1
+
+        previous = current
+
+    return min(previous[-1], max_distance + 1)
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree, finds the words within some edit distance
+    of a query while only comparing it to a small part of them
+    """
+    def __init__(self, words: Iterable[str] = ()):
+        self._root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        self._size = 0
+        self._longest = 0
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, word: str):
+        self._longest = max(self._longest, len(word))
+
+        if self._root is None:
+            self._root = (word, {})
+            self._size += 1
+            return
+
+        node_word, children = self._root
+        while True:
+            if (distance := levenshtein(word, node_word)) == 0:
+                return  # already there
+
+            if (child := children.get(distance)) is None:
+                children[distance] = (word, {})
+                self._size += 1
+                return
+
+            node_word, children = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Returns (distance, word) for every word close enough, closest first"""
+        if self._root is None or len(word) > self._longest + max_distance:
+            return []  # long spam doesn't even need to be compared
+
+        found = []
+        stack = [self._root]
+
+        while stack:
+            node_word, children = stack.pop()
+            # Past the largest child's distance + max_distance, every subtree
+            # gets skipped anyway, so the exact distance isn't needed
+            cap = max(children, default=0) + max_distance
+            distance = levenshtein(word, node_word, cap)
+
+            if distance <= max_distance:
+                found.append((distance, node_word))
+
+            # Triangle inequality, only these subtrees can hold matches
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+
+        found.sort()
+        return found
+
+    def closest(self, word: str, max_distance: int) -> Optional[str]:
+        """The closest word, ties go to the alphabetical order"""
+        if found := self.search(word, max_distance):
+            return found[0][1]
+        return None
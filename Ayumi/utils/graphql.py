@@ -0,0 +1,90 @@
+"""
+Ayumi - Anime discord bot
+Copyright (C) - 2020 | Saphielle Akiyama - saphielle.akiyama@gmail.com
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import re
+import functools
+from typing import Dict, Iterable, Optional, Tuple
+
+WHITESPACE_REGEX = re.compile(r"\s+")
+PUNCTUATOR_REGEX = re.compile(r"\s*([{}()\[\]:,=!])\s*")
+
+
+def minify_graphql(query: str) -> str:
+    """
+    Removes insignificant whitespace from a graphql document,
+    doesn't handle string literals since we never inline any
+    """
+    collapsed = re.sub(WHITESPACE_REGEX, ' ', query)
+    return re.sub(PUNCTUATOR_REGEX, r"\1", collapsed).strip()
+
+
+class Fragment:
+    """A named set of fields, declared once and spread wherever it's needed"""
+    __slots__ = ('name', 'on', 'fields', 'definition')
+
+    def __init__(self, name: str, on: str, fields: str):
+        self.name = name
+        self.on = on
+        self.fields = fields
+        self.definition = minify_graphql(f"fragment {name} on {on} {{{fields}}}")
+
+    @property
+    def spread(self) -> str:
+        return f"...{self.name}"
+
+    def __repr__(self) -> str:
+        return f"<Fragment name={self.name} on={self.on}>"
+
+
+class GraphQLQuery:
+    """
+    A query template, compiled once per set of filters and fragments
+
+    The template is formatted with %(variables)s, %(arguments)s and %(fields)s,
+    the first two include their parentheses, filters are optional arguments
+    that are only declared if they're used
+    """
+    def __init__(self,
+                 template: str, *,
+                 variables: Optional[Dict[str, str]] = None,
+                 filters: Optional[Dict[str, str]] = None):
+        self.template = template
+        self.variables = variables or {}
+        self.filters = filters or {}
+
+    def filters_from(self, variables: Iterable[str]) -> Tuple[str, ...]:
+        """Picks the filters that are used in some variables"""
+        return tuple(sorted(name for name in variables if name in self.filters))
+
+    @functools.lru_cache(maxsize=256)
+    def build(self, filters: Tuple[str, ...] = (), fragments: Tuple[Fragment, ...] = ()) -> str:
+        """Returns the minified query, cached"""
+        declared = {**self.variables, **{name: self.filters[name] for name in filters}}
+        f_variables = ', '.join(f"${name}: {type_}" for name, type_ in declared.items())
+        f_arguments = ', '.join(f"{name}: ${name}" for name in filters)
+        f_variables = f_variables and f"({f_variables})"
+        f_arguments = f_arguments and f"({f_arguments})"
+        f_fields = ' '.join(fragment.spread for fragment in fragments)
+
+        query = self.template % {
+            "variables": f_variables,
+            "arguments": f_arguments,
+            "fields": f_fields,
+        }
+        definitions = ''.join(fragment.definition for fragment in fragments)
+        return minify_graphql(query) + definitions
+
+    def build_for(self, variables: dict, fragments: Tuple[Fragment, ...] = ()) -> str:
+        """Same as build but the filters are picked from the variables that will be sent"""
+        return self.build(self.filters_from(variables), fragments)
@@ -1,7 +1,49 @@
 CREATE TABLE IF NOT EXISTS anime_reminders (
+    id bigserial PRIMARY KEY,
     user_id bigint NOT NULL,
     trigger_time timestamp with time zone NOT NULL,
     anime_name text NOT NULL,
     channel_id bigint NOT NULL
 );
 
+-- Tables created before reminders had ids
+ALTER TABLE anime_reminders ADD COLUMN IF NOT EXISTS id bigserial PRIMARY KEY;
+
+-- Reminders are loaded with keyset pagination on (trigger_time, id)
+DROP INDEX IF EXISTS anime_reminders_trigger_time_idx;
+CREATE INDEX IF NOT EXISTS anime_reminders_trigger_time_id_idx ON anime_reminders (trigger_time, id);
+
+-- Local mirror of anilist's upcoming episodes, refreshed by the Anilist cog
+CREATE TABLE IF NOT EXISTS airing_schedules (
+    id integer PRIMARY KEY,
+    media_id integer NOT NULL,
+    episode integer,
+    airing_at timestamp with time zone NOT NULL,
+    is_adult boolean NOT NULL,
+    media jsonb NOT NULL,
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS airing_schedules_airing_at_idx ON airing_schedules (airing_at);
+
+-- Local media catalog, lets search resolve titles without calling anilist
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS media_catalog (
+    id integer PRIMARY KEY,
+    is_adult boolean NOT NULL,
+    popularity integer NOT NULL DEFAULT 0,
+    titles text NOT NULL,
+    search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', titles)) STORED,
+    media jsonb NOT NULL,
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS media_catalog_titles_trgm_idx ON media_catalog USING gin (titles gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS media_catalog_search_vector_idx ON media_catalog USING gin (search_vector);
+
+-- When each background ingestion last completed, so that restarts don't redo them
+CREATE TABLE IF NOT EXISTS ingestions (
+    name text PRIMARY KEY,
+    finished_at timestamp with time zone NOT NULL
+);